@@ -0,0 +1,261 @@
+"""触发回放压力测试
+
+把记录下来的触发（config.json中的trigger_trace）或者合成的泊松/突发触发序列，按1到100倍速
+送进快捷键的触发路径（on_activate -> 触发队列 -> 预取 -> 声部分配），使用pygame的dummy音频驱动，
+结果以JSON输出：丢弃的触发、通道用尽、延迟分位数和内存增长。
+
+    python 回放测试.py --trace trace.txt --library . --speed 10
+    python 回放测试.py --pattern burst --duration 60 --speed 20 --output replay.json
+"""
+import os
+import io
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import threading
+import contextlib
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import 虎啸
+from 性能测试 import generate_library, distribution, peak_rss_bytes
+
+# ========== 触发序列 ==========
+def poisson_pattern(rate, duration, rng):
+    """平均每秒rate次、间隔服从指数分布的触发"""
+    triggers = []
+    at = rng.expovariate(rate)
+    while at < duration:
+        triggers.append((at, None))
+        at += rng.expovariate(rate)
+    return triggers
+
+def burst_pattern(size, interval, spread, duration, rng):
+    """每隔interval秒一阵连按：size次触发随机落在spread秒内"""
+    triggers = []
+    start = 0.0
+    while start < duration:
+        triggers.extend((start + rng.uniform(0, spread), None) for _ in range(size))
+        start += interval
+    triggers.sort(key=lambda item: item[0])
+    return triggers
+
+def speed_factor(text):
+    value = float(text)
+    if not 1 <= value <= 100:
+        raise argparse.ArgumentTypeError("倍速必须在1到100之间")
+    return value
+
+# ========== 回放 ==========
+class Sampler:
+    """定期采样进程内存、解码内存和活动声部数"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.rss = []
+        self.decoded = []
+        self.active = []
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        rss = 虎啸.process_rss_bytes()
+        if rss is not None:
+            self.rss.append(rss)
+        self.decoded.append(虎啸.sound_cache.stats()["bytes"] + 虎啸.variant_cache.stats()["bytes"])
+        self.active.append(虎啸.voice_manager.active_count())
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        self.sample()
+
+    def memory(self):
+        result = {"decoded_peak_bytes": max(self.decoded), "decoded_end_bytes": self.decoded[-1]}
+        if self.rss:
+            result.update({"rss_start_bytes": self.rss[0], "rss_peak_bytes": max(self.rss),
+                           "rss_end_bytes": self.rss[-1], "rss_growth_bytes": self.rss[-1] - self.rss[0]})
+        return result
+
+def replay(library_dir, engine_config, triggers, speed, tail, sample_interval):
+    """启动引擎并按倍速回放触发，返回统计结果"""
+    虎啸.base_dir = library_dir
+    虎啸.config = dict(engine_config)
+    虎啸.current_hotkey = 虎啸.current_hotkey_display = 虎啸.DEFAULT_HOTKEY
+    # 防抖和限速按记录时的时间计算：回放加速时同比例缩短防抖间隔、提高限速，
+    # 否则被丢弃的触发只是加速造成的
+    debounce_ms = engine_config.get("trigger_debounce_ms", 虎啸.DEFAULT_TRIGGER_DEBOUNCE_MS) / speed
+    max_per_second = engine_config.get("max_triggers_per_second", 虎啸.DEFAULT_MAX_TRIGGERS_PER_SECOND) * speed
+    虎啸.trigger_queue = 虎啸.TriggerQueue(
+        虎啸.play_random_audio,
+        debounce_ms=debounce_ms,
+        max_per_second=max_per_second,
+        burst=engine_config.get("trigger_burst", 虎啸.DEFAULT_TRIGGER_BURST))
+    # 保留全部样本，而不只是最近的几百个
+    虎啸.trigger_stats = 虎啸.TriggerStats(size=None)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        虎啸.init_audio()
+        虎啸.apply_pools([{"pool": pool} for _, pool in triggers if pool])
+        虎啸.decode_pool.fill()
+        虎啸.latency_monitor.samples = []
+        虎啸.start_audio()
+
+        sampler = Sampler(sample_interval)
+        sampler.start()
+        slips = []
+        begin = time.perf_counter()
+        for at, pool in triggers:
+            target = begin + at / speed
+            delay = target - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            slips.append(time.perf_counter() - target)
+            虎啸.on_activate({"pool": pool})
+        # 等触发队列处理完已接受的触发
+        drained = threading.Event()
+        虎啸.trigger_queue.call(drained.set)
+        drained.wait()
+        replay_seconds = time.perf_counter() - begin
+        time.sleep(tail)
+        sampler.stop()
+
+        queue_stats = 虎啸.trigger_queue.stats()
+        timing = 虎啸.trigger_stats.summary()
+        voices = 虎啸.voice_manager.stats()
+        totals = [sample[3] for sample in 虎啸.trigger_stats.recent]
+        result = {
+            "triggers": len(triggers),
+            "speed": speed,
+            "trace_seconds": round(triggers[-1][0], 3) if triggers else 0.0,
+            "replay_seconds": round(replay_seconds, 3),
+            "schedule_slip_ms": distribution(slips, 1000),
+            "scaled_limits": {"debounce_ms": round(debounce_ms, 3), "max_triggers_per_second": round(max_per_second, 3)},
+            "played": timing["played"],
+            "dropped": {
+                "debounce": queue_stats["suppressed_debounce"],
+                "rate_limit": queue_stats["suppressed_rate"],
+                "no_voice": timing["no_voice"],
+                "missing": timing["missing"],
+                "failed": timing["failed"],
+                "total": queue_stats["suppressed"] + timing["no_voice"] + timing["missing"] + timing["failed"],
+            },
+            "channels": {
+                "channels": voices["channels"],
+                "max_channels": voices["max_channels"],
+                "peak_active": max(sampler.active),
+                "steals": voices["steals"],
+                "grows": voices["grows"],
+                "drops": voices["drops"],
+                "underruns": 虎啸.latency_monitor.underruns,
+            },
+            "latency_ms": distribution(totals),
+            "stages_ms": {stage: timing[stage] for stage in 虎啸.TIMING_STAGES},
+            "memory": sampler.memory(),
+        }
+        if 虎啸.governor is not None:
+            虎啸.governor.stop()
+            result["governor"] = 虎啸.governor.stats()
+        虎啸.trigger_queue.stop()
+        虎啸.voice_manager.stop_reaper()
+        虎啸.voice_manager.stop_all()
+        虎啸.decode_pool.shutdown()
+        虎啸.variant_cache.shutdown()
+        虎啸.sound_cache.clear()
+        虎啸.audio_library.stop_watching()
+    return result
+
+# ========== 入口 ==========
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="触发回放压力测试（dummy音频驱动，输出JSON）")
+    parser.add_argument("--trace", default=None, help="回放的触发记录（每行\"秒数 [声音池]\"）")
+    parser.add_argument("--pattern", default="poisson", choices=["poisson", "burst"],
+                        help="没有--trace时合成的触发序列")
+    parser.add_argument("--duration", type=float, default=30.0, help="合成序列的长度（秒，按1倍速计）")
+    parser.add_argument("--rate", type=float, default=3.0, help="泊松序列平均每秒触发次数")
+    parser.add_argument("--burst-size", type=int, default=12, help="每阵连按的触发次数")
+    parser.add_argument("--burst-interval", type=float, default=5.0, help="两阵连按之间的间隔（秒）")
+    parser.add_argument("--burst-spread", type=float, default=1.0, help="一阵连按持续的时间（秒）")
+    parser.add_argument("--speed", type=speed_factor, default=1.0, help="回放倍速（1~100）")
+    parser.add_argument("--tail", type=float, default=1.0, help="最后一次触发后继续采样的秒数")
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="内存采样间隔（秒）")
+    parser.add_argument("--library", default=None, help="使用已有目录而不是生成合成音频库")
+    parser.add_argument("--config", default=None, help="使用的配置文件（默认使用音频库目录下的config.json）")
+    parser.add_argument("--files", type=int, default=30, help="合成音频文件数量")
+    parser.add_argument("--max-depth", type=int, default=2, help="子目录最大深度")
+    parser.add_argument("--min-seconds", type=float, default=0.3, help="最短音频长度（秒）")
+    parser.add_argument("--max-seconds", type=float, default=15.0, help="最长音频长度（秒）")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("--output", default=None, help="结果写入文件（默认输出到控制台）")
+    return parser.parse_args(argv)
+
+def load_engine_config(path):
+    if path and os.path.exists(path):
+        return 虎啸.read_config(path)
+    return 虎啸.default_config()
+
+def run(args):
+    rng = random.Random(args.seed)
+    if args.trace:
+        triggers = 虎啸.read_trigger_script(args.trace)
+        source = {"trace": os.path.abspath(args.trace)}
+    elif args.pattern == "poisson":
+        triggers = poisson_pattern(args.rate, args.duration, rng)
+        source = {"pattern": "poisson", "rate": args.rate, "duration": args.duration}
+    else:
+        triggers = burst_pattern(args.burst_size, args.burst_interval, args.burst_spread, args.duration, rng)
+        source = {"pattern": "burst", "size": args.burst_size, "interval": args.burst_interval,
+                  "spread": args.burst_spread, "duration": args.duration}
+
+    created = None
+    if args.library:
+        library_dir = os.path.abspath(args.library)
+        library_info = {"path": library_dir}
+    else:
+        created = library_dir = tempfile.mkdtemp(prefix="tigerroar_replay_")
+        library_info = generate_library(library_dir, args.files, args.max_depth,
+                                        args.min_seconds, args.max_seconds, args.seed)
+
+    try:
+        虎啸.import_mixer()
+        random.seed(args.seed)
+        engine_config = load_engine_config(args.config or os.path.join(library_dir, 虎啸.CONFIG_FILE))
+        result = replay(library_dir, engine_config, triggers, args.speed, args.tail, args.sample_interval)
+        return {
+            "version": 1,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "audio_driver": os.environ.get("SDL_AUDIODRIVER"),
+            "source": source,
+            "library": library_info,
+            "replay": result,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+    finally:
+        if created:
+            shutil.rmtree(created, ignore_errors=True)
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
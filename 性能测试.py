@@ -0,0 +1,318 @@
+"""播放路径性能测试
+
+在临时目录生成合成音频库（长度和目录深度随机的WAV/OGG文件），用pygame的dummy音频驱动
+跑一遍扫描、解码、声部分配和完整触发路径，结果以JSON输出，方便在版本之间比较。
+
+    python 性能测试.py --files 200 --triggers 300 --output bench.json
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import platform
+import importlib.util
+import contextlib
+import wave
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy
+
+import 虎啸
+
+# ========== 合成音频库 ==========
+SAMPLE_RATE = 44100
+FORMATS = ("wav", "ogg")
+
+def synth_pcm(seconds, rng):
+    """16位立体声PCM：衰减的噪声加正弦，响度分析和静音裁剪都能得到正常结果"""
+    frames = max(1, int(seconds * SAMPLE_RATE))
+    t = numpy.arange(frames) / SAMPLE_RATE
+    envelope = numpy.exp(-t * rng.uniform(0.5, 4.0))
+    tone = numpy.sin(2 * numpy.pi * rng.uniform(80, 400) * t)
+    noise = numpy.random.default_rng(rng.randrange(1 << 30)).uniform(-1, 1, frames)
+    mono = (0.6 * tone + 0.4 * noise) * envelope * rng.uniform(0.2, 0.9)
+    return (numpy.repeat(mono[:, None], 2, axis=1) * 32767).astype("<i2")
+
+def write_wav(path, pcm):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+
+def write_ogg(path, pcm):
+    """用soundfile编码成Ogg Vorbis，解码耗时才能反映压缩格式的真实开销"""
+    import soundfile
+    soundfile.write(path, pcm, SAMPLE_RATE, format="OGG", subtype="VORBIS")
+
+WRITERS = {"wav": write_wav, "ogg": write_ogg}
+
+def available_formats(formats):
+    """去掉当前环境写不出来的格式：OGG需要soundfile"""
+    if "ogg" in formats and importlib.util.find_spec("soundfile") is None:
+        print("未安装soundfile，合成音频库只生成WAV（pip install soundfile）", file=sys.stderr)
+        formats = [fmt for fmt in formats if fmt != "ogg"]
+    return list(formats) or ["wav"]
+
+def generate_library(target, count, max_depth, min_seconds, max_seconds, seed, formats=FORMATS):
+    """生成count个音频文件，格式在formats中轮流选取，放在1到max_depth层的子目录中
+
+    顶层不放文件：音频索引在顶层有文件时只使用顶层，这样所有文件都参与随机选择。
+    """
+    formats = available_formats(formats)
+    rng = random.Random(seed)
+    total_bytes = 0
+    total_seconds = 0.0
+    per_format = dict.fromkeys(formats, 0)
+    for i in range(count):
+        depth = rng.randint(1, max(1, max_depth))
+        parts = [f"d{level}_{rng.randrange(4)}" for level in range(depth)]
+        folder = os.path.join(target, *parts)
+        os.makedirs(folder, exist_ok=True)
+        fmt = formats[i % len(formats)]
+        path = os.path.join(folder, f"clip_{i:05d}.{fmt}")
+        seconds = rng.uniform(min_seconds, max_seconds)
+        WRITERS[fmt](path, synth_pcm(seconds, rng))
+        total_bytes += os.path.getsize(path)
+        total_seconds += seconds
+        per_format[fmt] += 1
+    return {"files": count, "formats": per_format, "bytes": total_bytes, "seconds": round(total_seconds, 2),
+            "max_depth": max_depth, "seed": seed}
+
+# ========== 统计工具 ==========
+def percentile(samples, fraction):
+    """按最近秩取分位数"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def distribution(samples, scale=1.0, digits=3):
+    """p50/p99/max/平均值，乘以scale后四舍五入"""
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean": round(sum(samples) / len(samples) * scale, digits),
+        "p50": round(percentile(samples, 0.50) * scale, digits),
+        "p99": round(percentile(samples, 0.99) * scale, digits),
+        "max": round(max(samples) * scale, digits),
+    }
+
+def peak_rss_bytes():
+    """进程峰值常驻内存，取不到时返回None"""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位是KB，macOS是字节
+        return peak if sys.platform == "darwin" else peak * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss)
+
+# ========== 各阶段测试 ==========
+def bench_scan(library_dir, repeat):
+    """冷扫描耗时，以及复制文件列表的单次耗时；同时返回扫描到的源文件"""
+    start = time.perf_counter()
+    library = 虎啸.AudioLibrary(library_dir, 0)
+    library.scan()
+    scan_seconds = time.perf_counter() - start
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        list(library.files)
+        samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    library.poll()
+    poll_seconds = time.perf_counter() - start
+    result = {
+        "scan_ms": round(scan_seconds * 1000, 3),
+        "poll_unchanged_ms": round(poll_seconds * 1000, 3),
+        "file_list_copy_us": distribution(samples, 1e6),
+        "clips": len(library.files),
+    }
+    return result, sorted(library.sources)
+
+def bench_decode(paths):
+    """逐个构造mixer.Sound，统计解码吞吐：全部文件合计，以及按扩展名分别统计"""
+    mixer = 虎啸.mixer
+    records = []  # 每项为 (扩展名, 耗时, PCM字节数, 音频秒数)
+    for path in paths:
+        start = time.perf_counter()
+        sound = mixer.Sound(path)
+        elapsed = time.perf_counter() - start
+        records.append((os.path.splitext(path)[1].lower().lstrip("."), elapsed,
+                        虎啸.sound_nbytes(sound), sound.get_length()))
+        del sound
+    result = decode_throughput(records)
+    formats = sorted({record[0] for record in records})
+    result["formats"] = {fmt: decode_throughput([r for r in records if r[0] == fmt]) for fmt in formats}
+    return result
+
+def decode_throughput(records):
+    samples = [record[1] for record in records]
+    elapsed = sum(samples)
+    pcm_bytes = sum(record[2] for record in records)
+    audio_seconds = sum(record[3] for record in records)
+    return {
+        "files": len(records),
+        "seconds": round(elapsed, 3),
+        "files_per_second": round(len(records) / elapsed, 1) if elapsed else None,
+        "pcm_mb_per_second": round(pcm_bytes / elapsed / 1e6, 1) if elapsed else None,
+        "audio_seconds_per_second": round(audio_seconds / elapsed, 1) if elapsed else None,
+        "per_file_ms": distribution(samples, 1000),
+    }
+
+def bench_voices(sound, count, channels):
+    """声部分配（相当于原来的find_channel加play），包含通道用满后的抢占"""
+    manager = 虎啸.VoiceManager(num_channels=channels, max_channels=channels)
+    samples = []
+    for i in range(count):
+        start = time.perf_counter()
+        manager.play(f"bench_{i % 16}", sound)
+        samples.append(time.perf_counter() - start)
+    stats = manager.stats()
+    manager.stop_all()
+    return {"play_us": distribution(samples, 1e6), "steals": stats["steals"], "drops": stats["drops"]}
+
+def bench_triggers(library_dir, count, interval, engine_config):
+    """完整触发路径：入队 -> 取预取结果 -> 分配声部 -> channel.play"""
+    虎啸.base_dir = library_dir
+    虎啸.config = dict(engine_config)
+    虎啸.current_hotkey = 虎啸.current_hotkey_display = 虎啸.DEFAULT_HOTKEY
+    虎啸.trigger_queue = 虎啸.TriggerQueue(虎啸.play_random_audio, debounce_ms=0, max_per_second=0)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        虎啸.init_audio()
+        init_seconds = time.perf_counter() - start
+        # 保留全部延迟样本，而不只是最近的200个
+        虎啸.latency_monitor.samples = []
+        虎啸.start_audio()
+
+        begin = time.perf_counter()
+        for _ in range(count):
+            虎啸.trigger_queue.submit(None)
+            if interval:
+                time.sleep(interval)
+        虎啸.trigger_queue.stop()
+        elapsed = time.perf_counter() - begin
+
+        samples = list(虎啸.latency_monitor.samples)
+        result = {
+            "engine_init_ms": round(init_seconds * 1000, 3),
+            "triggers": count,
+            "interval_ms": interval * 1000,
+            "seconds": round(elapsed, 3),
+            "latency_ms": distribution(samples),
+            "prefetch": {"ready": 虎啸.decode_pool.ready_hits, "waits": 虎啸.decode_pool.waits},
+            "cache": 虎啸.sound_cache.stats(),
+            "voices": 虎啸.voice_manager.stats(),
+        }
+        虎啸.voice_manager.stop_reaper()
+        虎啸.voice_manager.stop_all()
+        虎啸.decode_pool.shutdown()
+        虎啸.sound_cache.clear()
+        虎啸.audio_library.stop_watching()
+    return result
+
+# ========== 入口 ==========
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="播放路径性能测试（dummy音频驱动，输出JSON）")
+    parser.add_argument("--files", type=int, default=200, help="合成音频文件数量")
+    parser.add_argument("--max-depth", type=int, default=3, help="子目录最大深度")
+    parser.add_argument("--min-seconds", type=float, default=0.2, help="最短音频长度（秒）")
+    parser.add_argument("--max-seconds", type=float, default=6.0, help="最长音频长度（秒）")
+    parser.add_argument("--formats", default=",".join(FORMATS), help="合成音频的格式，逗号分隔（wav、ogg）")
+    parser.add_argument("--triggers", type=int, default=300, help="完整触发路径的触发次数")
+    parser.add_argument("--interval-ms", type=float, default=10.0, help="两次触发之间的间隔（毫秒）")
+    parser.add_argument("--profile", default=虎啸.DEFAULT_LATENCY_PROFILE, choices=list(虎啸.LATENCY_PROFILES),
+                        help="延迟档位")
+    parser.add_argument("--normalize", action="store_true", help="开启响度归一化和静音裁剪（默认关闭，只测播放路径）")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("--library", default=None, help="使用已有目录而不是生成合成音频库")
+    parser.add_argument("--keep", action="store_true", help="保留生成的合成音频库")
+    parser.add_argument("--output", default=None, help="结果写入文件（默认输出到控制台）")
+    return parser.parse_args(argv)
+
+def run(args):
+    created = None
+    if args.library:
+        library_dir = os.path.abspath(args.library)
+        library_info = {"path": library_dir}
+    else:
+        created = library_dir = tempfile.mkdtemp(prefix="tigerroar_bench_")
+        start = time.perf_counter()
+        formats = [fmt.strip().lower() for fmt in args.formats.split(",") if fmt.strip()]
+        unknown = [fmt for fmt in formats if fmt not in WRITERS]
+        if unknown:
+            raise SystemExit(f"不支持的格式: {', '.join(unknown)}")
+        library_info = generate_library(library_dir, args.files, args.max_depth,
+                                        args.min_seconds, args.max_seconds, args.seed, formats)
+        library_info["generate_seconds"] = round(time.perf_counter() - start, 3)
+
+    try:
+        mixer = 虎啸.import_mixer()
+        engine_config = {
+            "latency_profile": args.profile,
+            "normalize": args.normalize,
+            "trim_silence": args.normalize,
+            "split_clips": args.normalize,
+            "dedupe": args.normalize,
+            "pcm_cache": False,
+        }
+
+        scan, paths = bench_scan(library_dir, 1000)
+        # 解码和声部测试需要先初始化mixer
+        with contextlib.redirect_stdout(io.StringIO()):
+            虎啸.init_mixer(args.profile)
+        decode = bench_decode(paths)
+        voices = bench_voices(mixer.Sound(paths[0]), 2000, 虎啸.DEFAULT_MIXER_CHANNELS) if paths else None
+        mixer.quit()
+        triggers = bench_triggers(library_dir, args.triggers, args.interval_ms / 1000, engine_config)
+
+        return {
+            "version": 1,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pygame": sys.modules["pygame"].version.ver,
+            "platform": platform.platform(),
+            "audio_driver": os.environ.get("SDL_AUDIODRIVER"),
+            "library": library_info,
+            "scan": scan,
+            "decode": decode,
+            "voices": voices,
+            "trigger": triggers,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+    finally:
+        if created and not args.keep:
+            shutil.rmtree(created, ignore_errors=True)
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
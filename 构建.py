@@ -1,23 +1,85 @@
 import os
 import sys
+import json
+import time
+import hashlib
+import argparse
+import importlib.util
 import subprocess
 import shutil
 from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+APP_NAME = '随机音频播放器'
+BUILD_DIR = Path('build')
+DIST_DIR = Path('dist')
+STATE_FILE = BUILD_DIR / 'build_state.json'  # 上次构建的输入哈希，和PyInstaller缓存放在一起
+EXE_SUFFIX = '.exe' if os.name == 'nt' else ''
+
+# ========== 阶段计时 ==========
+stage_times = []  # (阶段, 秒)
+
+@contextmanager
+def stage(name):
+    """计时一个构建阶段"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_times.append((name, elapsed))
+        print(f"[{name}] {elapsed:.2f}s")
+
+def print_stage_times():
+    print("各阶段耗时:")
+    for name, elapsed in stage_times:
+        print(f"  {name:<12}{elapsed:>8.2f}s")
+
+# ========== 增量构建 ==========
+def file_hash(path):
+    """文件内容的SHA-1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def inputs_hash(paths, extra=None):
+    """一组输入文件（内容）和附加参数的总哈希，文件顺序无关"""
+    digest = hashlib.sha1()
+    for path in sorted(str(p) for p in paths):
+        digest.update(path.encode('utf-8'))
+        digest.update(file_hash(path).encode('ascii') if os.path.exists(path) else b'-')
+    digest.update(json.dumps(extra, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state):
+    BUILD_DIR.mkdir(exist_ok=True)
+    with open(STATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
 
 def check_and_install_dependencies():
-    """检查并安装所有必需的依赖"""
-    required_packages = [
-        'pygame',
-        'pynput',
-        'pyinstaller'
-    ]
+    """检查并安装所有必需的依赖（只查找模块，不导入）"""
+    required_packages = {
+        'pygame': 'pygame',
+        'pynput': 'pynput',
+        'numpy': 'numpy',  # 打包采样库时做响度分析和静音裁剪
+        'pyinstaller': 'PyInstaller',
+    }
     
     print("正在检查并安装依赖包...")
-    for package in required_packages:
-        try:
-            __import__(package.split('.')[0])
+    for package, module in required_packages.items():
+        if importlib.util.find_spec(module) is not None:
             print(f"✓ {package} 已安装")
-        except ImportError:
+        else:
             print(f"正在安装 {package}...")
             subprocess.check_call([sys.executable, '-m', 'pip', 'install', package])
 
@@ -53,33 +115,82 @@ def get_icon_path():
     
     return 'NONE'
 
-def build_exe():
-    """构建EXE文件"""
-    print("开始构建EXE文件...")
+def build_sample_bank(state=None, force=False):
+    """把当前目录下的音频预先解码、分析后打包成一个采样库文件，运行时直接内存映射
+
+    state不为None时按音频文件、虎啸.py和配置的哈希判断，输入没变且采样库存在时跳过。
+    """
+    print("正在打包采样库...")
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    try:
+        import 虎啸
+    except ImportError as e:
+        print(f"✗ 无法导入虎啸.py: {e}")
+        return False
     
-    # 获取图标路径
-    icon_path = get_icon_path()
-    icon_arg = f'--icon={icon_path}' if icon_path != 'NONE' else '--icon=NONE'
+    config = 虎啸.load_config()
+    bank_name = config.get('sample_bank', 虎啸.DEFAULT_SAMPLE_BANK)
+    if not bank_name:
+        print("配置中未启用采样库，跳过")
+        return True
+    
+    base_dir = os.path.abspath('.')
+    bank_path = os.path.join(base_dir, bank_name)
+    if state is not None:
+        library = 虎啸.AudioLibrary(base_dir, 0)
+        library.scan()
+        bank_config = {key: config.get(key) for key in ('latency_profile', 'trim_silence', 'silence_threshold_db',
+                                                        'split_clips', 'split_min_seconds', 'split_min_gap_seconds')}
+        digest = inputs_hash(library.all_sources() + ['虎啸.py'], bank_config)
+        if not force and state.get('bank') == digest and os.path.exists(bank_path):
+            print(f"✓ 采样库没有变化，跳过: {bank_name}")
+            return True
+    try:
+        虎啸.import_mixer()
+        # 采样格式必须和运行时的混音器一致
+        虎啸.init_mixer(config.get('latency_profile', 虎啸.DEFAULT_LATENCY_PROFILE))
+        count = 虎啸.write_sample_bank(bank_path, base_dir, 虎啸.trim_options_from_config(config),
+                                       progress=lambda done, total, path: print(f"  [{done}/{total}] {os.path.basename(path)}"))
+        虎啸.mixer.quit()
+    except Exception as e:
+        print(f"✗ 采样库打包失败: {e}")
+        return False
     
-    # PyInstaller配置
-    pyinstaller_args = [
-        'pyinstaller',
-        '--onefile',           # 单文件
+    size_mb = os.path.getsize(bank_path) / 1024 / 1024
+    print(f"✓ 采样库已生成: {bank_name} ({count}个文件, {size_mb:.1f} MB)")
+    if state is not None:
+        state['bank'] = digest
+    return True
+
+def pyinstaller_args(icon_path, onedir=False):
+    """PyInstaller参数，相当于spec文件的内容，也参与增量构建的哈希"""
+    icon_arg = f'--icon={icon_path}' if icon_path != 'NONE' else '--icon=NONE'
+    return [
+        '--onedir' if onedir else '--onefile',  # 单目录启动更快，单文件方便分发
         '--windowed',          # 无控制台窗口
-        '--name=随机音频播放器', # EXE名称
-        icon_arg,              # 图标参数（修改这里）
-        '--add-data=虎啸.py;.', # 包含脚本
+        f'--name={APP_NAME}',  # EXE名称
+        icon_arg,              # 图标参数
+        f'--add-data=虎啸.py{os.pathsep}.', # 包含脚本
         '--hidden-import=pygame',
         '--hidden-import=pygame.mixer',
         '--hidden-import=pynput',
         '--hidden-import=pynput.keyboard',
         '--hidden-import=tkinter',
+        '--noconfirm',
+        f'--workpath={BUILD_DIR}',
+        f'--distpath={DIST_DIR}',
         '虎啸.py'
     ]
-    
-    
+
+def build_output(onedir=False):
+    """PyInstaller的输出：单文件模式是EXE，单目录模式是目录"""
+    return DIST_DIR / APP_NAME if onedir else DIST_DIR / (APP_NAME + EXE_SUFFIX)
+
+def build_exe(args):
+    """构建EXE文件（保留build目录，PyInstaller可以复用上次的分析缓存）"""
+    print("开始构建EXE文件...")
     try:
-        subprocess.check_call(pyinstaller_args)
+        subprocess.check_call([sys.executable, '-m', 'PyInstaller'] + args)
         print("✓ EXE构建完成！")
     except subprocess.CalledProcessError as e:
         print(f"✗ 构建失败: {e}")
@@ -87,64 +198,126 @@ def build_exe():
     
     return True
 
-def cleanup_and_move():
-    """清理临时文件并移动EXE"""
-    print("正在清理和移动文件...")
-    
-    # 源EXE路径
-    source_exe = Path('dist') / '随机音频播放器.exe'
+def install_output(onedir=False):
+    """把构建结果复制到当前目录（保留dist，下次没有变化时可以直接复用）"""
+    source = build_output(onedir)
+    if not source.exists():
+        print("✗ EXE文件未找到")
+        return False
     
-    if source_exe.exists():
-        # 移动到当前目录
-        target_exe = Path('随机音频播放器.exe')
-        shutil.move(str(source_exe), str(target_exe))
-        
-        # 清理构建文件
-        if Path('build').exists():
-            shutil.rmtree('build')
-        if Path('dist').exists():
-            shutil.rmtree('dist')
-        if Path('随机音频播放器.spec').exists():
-            os.remove('随机音频播放器.spec')
-        
-        print(f"✓ EXE已创建: {target_exe}")
-        return True
+    if onedir:
+        # 单目录模式：EXE和_internal目录一起放到音频文件旁边
+        shutil.copytree(source, Path('.'), dirs_exist_ok=True)
+        target = Path(APP_NAME + EXE_SUFFIX)
     else:
-        print("✗ EXE文件未找到")
+        target = Path(source.name)
+        shutil.copy2(source, target)
+    print(f"✓ EXE已创建: {target}")
+    return True
+
+def cleanup():
+    """删除构建缓存（--clean）"""
+    print("正在清理构建文件...")
+    for path in (BUILD_DIR, DIST_DIR):
+        if path.exists():
+            shutil.rmtree(path)
+    spec = Path(APP_NAME + '.spec')
+    if spec.exists():
+        os.remove(spec)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="随机音频播放器 - EXE打包工具")
+    parser.add_argument('--onedir', action='store_true', help="构建单目录程序（启动比单文件快很多）")
+    parser.add_argument('--force', action='store_true', help="输入没有变化也重新构建")
+    parser.add_argument('--clean', action='store_true', help="构建前删除build/dist缓存（完全重新构建）")
+    parser.add_argument('--no-bank', action='store_true', help="不打包采样库")
+    parser.add_argument('--no-pause', action='store_true', help="结束时不等待回车")
+    return parser.parse_args(argv)
+
+def run(args):
+    """执行构建，返回是否成功"""
+    # 检查当前目录是否有脚本文件
+    if not Path('虎啸.py').exists():
+        print("错误: 请在包含'虎啸.py'的目录中运行此脚本")
         return False
+    
+    if args.clean:
+        with stage("清理"):
+            cleanup()
+    
+    # 安装依赖
+    with stage("检查依赖"):
+        check_and_install_dependencies()
+    
+    state = load_state()
+    
+    # 图标转换和采样库打包互不依赖，并行执行（失败时程序仍可以直接解码音频文件）
+    def icon_job():
+        with stage("图标"):
+            return get_icon_path()
+    
+    def bank_job():
+        with stage("采样库"):
+            return build_sample_bank(state, args.force)
+    
+    with stage("资源预处理"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            icon_future = executor.submit(icon_job)
+            bank_future = None if args.no_bank else executor.submit(bank_job)
+            icon_path = icon_future.result()
+            if bank_future is not None:
+                bank_future.result()
+    
+    pyinstaller = pyinstaller_args(icon_path, args.onedir)
+    with stage("计算哈希"):
+        import PyInstaller
+        inputs = ['虎啸.py'] + ([icon_path] if icon_path != 'NONE' else [])
+        digest = inputs_hash(inputs, {'args': pyinstaller, 'pyinstaller': PyInstaller.__version__})
+    
+    output_key = 'onedir' if args.onedir else 'onefile'
+    if not args.force and state.get(output_key) == digest and build_output(args.onedir).exists():
+        print("✓ 源文件、图标和构建参数都没有变化，跳过PyInstaller")
+    else:
+        with stage("PyInstaller"):
+            if not build_exe(pyinstaller):
+                save_state(state)
+                return False
+        state[output_key] = digest
+    save_state(state)
+    
+    with stage("复制结果"):
+        if not install_output(args.onedir):
+            return False
+    return True
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
     print("=" * 50)
     print("随机音频播放器 - EXE打包工具")
     print("=" * 50)
     
-    # 检查当前目录是否有脚本文件
-    if not Path('虎啸.py').exists():
-        print("错误: 请在包含'虎啸.py'的目录中运行此脚本")
-        input("按回车键退出...")
-        return
+    start = time.perf_counter()
+    ok = run(args)
+    print_stage_times()
+    print(f"总耗时: {time.perf_counter() - start:.2f}s")
     
-    # 安装依赖
-    check_and_install_dependencies()
-    
-    # 构建EXE
-    if build_exe():
-        # 移动和清理
-        if cleanup_and_move():
-            print("\n" + "=" * 50)
-            print("打包完成！")
-            print("使用说明:")
-            print("1. 将 '随机音频播放器.exe' 复制到任何包含音频文件的目录")
-            print("2. 双击运行即可播放该目录下的音频")
-            print("3. 支持格式: MP3, WAV, OGG, FLAC")
-            print("4. 快捷键: Ctrl键全局触发播放")
-            print("=" * 50)
-        else:
-            print("✗ 文件移动失败")
+    if ok:
+        print("\n" + "=" * 50)
+        print("打包完成！")
+        print("使用说明:")
+        print("1. 将 '随机音频播放器.exe' 复制到任何包含音频文件的目录")
+        print("2. 双击运行即可播放该目录下的音频")
+        print("3. 支持格式: MP3, WAV, OGG, FLAC")
+        print("4. 快捷键: Ctrl键全局触发播放")
+        print("5. 和音频文件一起分发 'sample_bank.bin' 可以跳过启动时的解码和分析")
+        if args.onedir:
+            print("6. 单目录模式需要同时复制 '_internal' 目录")
+        print("=" * 50)
     else:
         print("✗ 打包过程失败")
     
-    input("\n按回车键退出...")
+    if not args.no_pause:
+        input("\n按回车键退出...")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
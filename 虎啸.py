@@ -2,197 +2,3859 @@ import os
 import sys
 import random
 import json
-import tkinter as tk
-from pygame import mixer
-from tkinter import messagebox, ttk
-from pynput import keyboard
+import shutil
+import argparse
+import socketserver
 import threading
-from tkinter import simpledialog
+import time
+import hashlib
+import mmap
+import struct
+import fnmatch
+import wave
+import queue
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# ========== 延迟导入与启动计时 ==========
+# pygame、pynput和tkinter导入较慢，改为第一次用到时再导入，窗口和快捷键可以先出现
+STARTUP_T0 = time.perf_counter()
+mixer = None
+keyboard = None
+
+def import_mixer():
+    """导入pygame.mixer（只导入一次）"""
+    global mixer
+    if mixer is None:
+        from pygame import mixer as pygame_mixer
+        mixer = pygame_mixer
+    return mixer
+
+def import_keyboard():
+    """导入pynput.keyboard（只导入一次）"""
+    global keyboard
+    if keyboard is None:
+        from pynput import keyboard as pynput_keyboard
+        keyboard = pynput_keyboard
+    return keyboard
+
+class StartupProfiler:
+    """记录启动各阶段的耗时，--profile-startup时在音频加载完成后输出"""
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = []  # (阶段, 开始时间, 耗时, 线程名)，时间相对于程序启动
+        self.lock = threading.Lock()
+
+    def _record(self, name, start, duration):
+        with self.lock:
+            self.phases.append((name, start - STARTUP_T0, duration, threading.current_thread().name))
+
+    @contextmanager
+    def phase(self, name):
+        """计时一个阶段"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, start, time.perf_counter() - start)
+
+    def mark(self, name):
+        """记录一个时间点（耗时为0）"""
+        self._record(name, time.perf_counter(), 0.0)
+
+    def report(self):
+        """按开始时间排序的耗时表（毫秒）"""
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        lines = ["启动耗时（毫秒）:", f"  {'阶段':<14}{'开始':>9}{'耗时':>9}  线程"]
+        for name, start, duration, thread in phases:
+            lines.append(f"  {name:<14}{start * 1000:>9.1f}{duration * 1000:>9.1f}  {thread}")
+        return "\n".join(lines)
+
+startup_profiler = StartupProfiler()
 
 # ========== 配置管理 ==========
 CONFIG_FILE = "config.json"
 DEFAULT_HOTKEY = "<ctrl>+<alt>"
+DEFAULT_SOUND_CACHE_MB = 128
+DEFAULT_PREFETCH_DEPTH = 2
+DEFAULT_DECODE_WORKERS = 2
+DEFAULT_LATENCY_PROFILE = "balanced"
+DEFAULT_MIXER_CHANNELS = 32
+DEFAULT_MAX_CHANNELS = 64
+DEFAULT_STEAL_POLICY = "oldest"
+DEFAULT_MAX_INSTANCES_PER_FILE = 0
+PCM_CACHE_DIR = "pcm_cache"
+ANALYSIS_FILE = "audio_analysis.json"
+DEFAULT_NORMALIZE_TARGET_DB = -20.0
+DEFAULT_LIMITER = "voices"
+DEFAULT_SILENCE_THRESHOLD_DB = -50.0
+DEFAULT_SPLIT_MIN_SECONDS = 20.0
+DEFAULT_SPLIT_MIN_GAP_SECONDS = 0.5
+DEFAULT_NO_REPEAT_WINDOW = 3
+DEFAULT_WEIGHT_MODE = "uniform"
+DEFAULT_TRIGGER_DEBOUNCE_MS = 30
+DEFAULT_MAX_TRIGGERS_PER_SECOND = 20
+DEFAULT_TRIGGER_BURST = 5
+DEFAULT_CONTROL_PORT = 47800
+DEFAULT_STREAM_MIN_SECONDS = 30.0
+DEFAULT_STREAM_MIN_MB = 1.0
+DEFAULT_STREAM_CHUNK_SECONDS = 2.0
+DEFAULT_SAMPLE_BANK = "sample_bank.bin"
+DEFAULT_PITCH_VARIATION_SEMITONES = 0.0
+DEFAULT_PITCH_VARIANTS = 4
+DEFAULT_VARIANT_CACHE_MB = 64
+DEFAULT_RENDER_OUTPUT = os.path.join(tempfile.gettempdir(), "tigerroar_render.wav")  # 不写进音频目录，否则下次会被当作音频
+DEFAULT_DEDUPE_THRESHOLD = 0.05  # 指纹平均差异（0~1）不超过此值视为重复
+DEFAULT_DEDUPE_LENGTH_TOLERANCE = 0.05  # 时长相差不超过5%才比较指纹
+DEFAULT_TRIGGER_TRACE = ""  # 记录快捷键触发的文件，空字符串表示不记录
+DEFAULT_GOVERNOR_INTERVAL_SECONDS = 1.0
+DEFAULT_GOVERNOR_RSS_MB = 512  # 进程常驻内存超过此值视为紧张，0表示不检查
+DEFAULT_GOVERNOR_DECODED_HEADROOM_MB = 64  # 解码内存（缓存+变调版本+正在播放）超出两个缓存预算之和再多此值时视为紧张，0表示不检查
+DEFAULT_GOVERNOR_CHANNEL_LOAD = 0.9  # 活动声部占通道上限的比例超过此值视为紧张，0表示不检查
+DEFAULT_GOVERNOR_RELEASE_RATIO = 0.8  # 各项指标都低于阈值的这个比例才算恢复
+DEFAULT_GOVERNOR_CALM_CHECKS = 5  # 连续这么多次检查都恢复后才退回上一级
+DEFAULT_GOVERNOR_SHORT_CLIP_SECONDS = 5.0
+DEFAULT_GOVERNOR_VOICE_LIMIT = 8
+
+CONFIG_VERSION = 1
+CONFIG_SAVE_DELAY = 0.5  # 秒，这段时间内的多次保存合并成一次写入
+CONFIG_POLL_SECONDS = 1.0
+
+NUMBER = (int, float)
+# 配置项 -> 允许的类型；类型不对的项会被丢弃，使用代码中的默认值
+CONFIG_SCHEMA = {
+    "config_version": int,
+    "hotkey": str, "hotkey_display": str,
+    "bindings": list, "tags": dict,
+    "sound_cache_mb": NUMBER, "library_poll_seconds": NUMBER,
+    "prefetch_depth": int, "decode_workers": int,
+    "latency_profile": str,
+    "mixer_channels": int, "max_channels": int,
+    "steal_policy": str, "max_instances_per_file": int,
+    "pcm_cache": bool, "sample_bank": str,
+    "normalize": bool, "normalize_target_db": NUMBER, "limiter": str,
+    "trim_silence": bool, "silence_threshold_db": NUMBER,
+    "split_clips": bool, "split_min_seconds": NUMBER, "split_min_gap_seconds": NUMBER,
+    "no_repeat_window": int, "weight_mode": str, "clip_weights": dict,
+    "trigger_debounce_ms": NUMBER, "max_triggers_per_second": NUMBER, "trigger_burst": int,
+    "control_port": int,
+    "stats_log": str, "stats_interval_seconds": NUMBER,
+    "stream_long_files": bool, "stream_min_seconds": NUMBER, "stream_min_mb": NUMBER,
+    "stream_chunk_seconds": NUMBER,
+    "pitch_variation_semitones": NUMBER, "pitch_variants": int, "variant_cache_mb": NUMBER,
+    "software_mixer": bool, "software_block_frames": int,
+    "dedupe": bool, "dedupe_threshold": NUMBER, "dedupe_length_tolerance": NUMBER,
+    "trigger_trace": str,
+    "governor": bool, "governor_interval_seconds": NUMBER, "governor_rss_mb": NUMBER,
+    "governor_decoded_headroom_mb": NUMBER, "governor_channel_load": NUMBER, "governor_release_ratio": NUMBER,
+    "governor_calm_checks": int, "governor_short_clip_seconds": NUMBER, "governor_voice_limit": int,
+}
+
+def config_path():
+    return os.path.join(get_base_path(), CONFIG_FILE)
+
+def default_config():
+    return {"config_version": CONFIG_VERSION, "hotkey": DEFAULT_HOTKEY, "hotkey_display": DEFAULT_HOTKEY}
+
+def migrate_config(data):
+    """把旧版本的配置升级到当前版本"""
+    version = data.get("config_version", 0)
+    if not isinstance(version, int) or version > CONFIG_VERSION:
+        print(f"配置文件版本 {version} 比程序支持的 {CONFIG_VERSION} 新，按当前版本读取")
+    # 版本0（没有版本号）和版本1的字段相同
+    data["config_version"] = CONFIG_VERSION
+    return data
+
+def validate_config(data):
+    """按CONFIG_SCHEMA检查类型，不合法的项丢弃并提示；未知的项原样保留"""
+    for key, types in CONFIG_SCHEMA.items():
+        if key not in data:
+            continue
+        value = data[key]
+        # bool是int的子类，数值项不接受true/false
+        if not isinstance(value, types) or (isinstance(value, bool) and types is not bool):
+            print(f"配置项 {key} 的值 {value!r} 类型不正确，使用默认值")
+            del data[key]
+    return data
+
+def read_config(path):
+    """读取并校验配置文件，格式错误时抛出ValueError"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("配置文件顶层必须是对象")
+    return validate_config(migrate_config(data))
+
+def backup_bad_config(path):
+    """保留无法读取的配置文件副本，返回备份路径"""
+    backup = f"{path}.bad-{time.strftime('%Y%m%d-%H%M%S')}"
+    try:
+        shutil.copy2(path, backup)
+        return backup
+    except OSError as e:
+        print(f"备份配置文件失败: {e}")
+        return None
+
+def load_config():
+    """加载配置文件；文件损坏时先备份再使用默认配置"""
+    path = config_path()
+    if not os.path.exists(path):
+        return default_config()
+    try:
+        return read_config(path)
+    except (OSError, ValueError) as e:
+        backup = backup_bad_config(path)
+        print(f"配置文件无法读取（{e}），已备份为 {backup}，本次使用默认配置")
+        return default_config()
+
+def file_signature(path):
+    """(mtime, size)，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+def write_file_atomic(path, text):
+    """先写临时文件并刷到磁盘，再改名替换，写到一半崩溃也不会留下残缺的文件"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class ConfigSaver:
+    """后台线程合并保存配置：短时间内多次修改只写一次，调用方不用等待磁盘"""
+
+    def __init__(self, delay=CONFIG_SAVE_DELAY):
+        self.delay = delay
+        self.cond = threading.Condition()
+        self.pending = None  # 等待写入的(路径, 文本)
+        self.due = 0.0
+        self.written = None  # 最近一次写入后的文件签名，监视线程据此忽略自己的修改
+        self._thread = None
+
+    def schedule(self, path, text):
+        with self.cond:
+            self.pending = (path, text)
+            self.due = time.monotonic() + self.delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="config-saver", daemon=True)
+                self._thread.start()
+            self.cond.notify()
+
+    def _write(self, item):
+        path, text = item
+        try:
+            write_file_atomic(path, text)
+            self.written = file_signature(path)
+        except OSError as e:
+            print(f"保存配置失败: {e}")
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.pending is None or time.monotonic() < self.due:
+                    self.cond.wait(None if self.pending is None else self.due - time.monotonic())
+                item = self.pending
+                self.pending = None
+            self._write(item)
+
+    def flush(self):
+        """立即写入尚未保存的修改（退出前调用）"""
+        with self.cond:
+            item = self.pending
+            self.pending = None
+        if item is not None:
+            self._write(item)
+
+config_saver = ConfigSaver()
+
+def save_config(config):
+    """保存配置文件：在调用线程中序列化（无法序列化时返回False），由后台线程合并写入"""
+    try:
+        text = json.dumps({**config, "config_version": CONFIG_VERSION}, ensure_ascii=False, indent=2)
+    except (TypeError, ValueError) as e:
+        print(f"配置无法保存: {e}")
+        return False
+    config_saver.schedule(config_path(), text)
+    return True
+
+class ConfigWatcher:
+    """轮询配置文件的修改时间，被外部修改后读取新配置并回调（自己保存的修改会被忽略）"""
+
+    def __init__(self, path, on_change, interval=CONFIG_POLL_SECONDS):
+        self.path = path
+        self.on_change = on_change  # 回调(新配置)，在监视线程中调用
+        self.interval = interval
+        self.seen = file_signature(path)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """检查一次，文件变化并读取成功时回调，返回是否回调"""
+        signature = file_signature(self.path)
+        if signature is None or signature == self.seen:
+            return False
+        self.seen = signature
+        if signature == config_saver.written:
+            return False
+        try:
+            new_config = read_config(self.path)
+        except (OSError, ValueError) as e:
+            # 编辑器保存到一半或写错了，保留当前配置；下次程序保存会覆盖它，先留一份
+            backup = backup_bad_config(self.path)
+            print(f"配置文件格式错误（{e}），保持当前配置，已备份为 {backup}")
+            return False
+        self.on_change(new_config)
+        return True
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"应用配置失败: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+# ========== 路径处理 ==========
+_base_path = None
+
+def get_base_path():
+    """获取程序的基准路径（支持源码和打包后）"""
+    global _base_path
+    if _base_path is not None:
+        return _base_path
+    
+    if getattr(sys, 'frozen', False):
+        # 打包后的EXE
+        base_path = os.path.dirname(sys.executable)
+    else:
+        # 源码运行
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    
+    print(f"DEBUG: 程序路径: {base_path}")
+    _base_path = base_path
+    return base_path
+
+# ========== 音频索引 ==========
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac')
+DEFAULT_LIBRARY_POLL_SECONDS = 2.0
+CLIP_SEPARATOR = "::"  # 切分出的片段ID: 文件路径::序号
+
+def make_clip_id(path, index):
+    return f"{path}{CLIP_SEPARATOR}{index}"
+
+def split_clip_id(clip_id):
+    """把片段ID拆成(文件路径, 片段序号)，未切分的文件序号为None"""
+    path, sep, index = clip_id.rpartition(CLIP_SEPARATOR)
+    if sep and index.isdigit():
+        return path, int(index)
+    return clip_id, None
+
+def clip_source(clip_id):
+    """片段所属的源文件路径"""
+    return split_clip_id(clip_id)[0]
+
+def clip_display_name(clip_id):
+    """界面上显示的片段名称"""
+    path, index = split_clip_id(clip_id)
+    if index is None:
+        return os.path.basename(path)
+    return f"{os.path.basename(path)} [{index + 1}]"
+
+class AudioLibrary:
+    """常驻内存的音频索引：启动时扫描一次，之后轮询目录修改时间做增量更新"""
+
+    def __init__(self, base_dir, poll_interval=DEFAULT_LIBRARY_POLL_SECONDS, selector=None):
+        self.base_dir = base_dir
+        self.poll_interval = poll_interval
+        self.selector = selector or ClipSelector()
+        self.weight_func = None  # 片段ID -> 权重，None表示等权
+        self.dirs = {}  # 目录 -> (mtime, 音频文件列表, 子目录列表)
+        self.sources = []  # 参与选择的源文件
+        self.files = []  # 当前可供随机选择的片段ID（未切分的文件就是其路径）
+        self.metadata = {}  # 文件路径 -> 分析结果（带mtime/size用于判断是否过期）
+        self.metadata_path = None
+        self.trim = None  # 当前的裁剪参数签名（TrimOptions.signature()），None表示不裁剪
+        self.pool_filters = {}  # 声音池名称 -> 判断源文件是否属于该池的函数
+        self.pools = {}  # 声音池名称 -> (片段ID列表, ClipSelector)
+        self.dedupe = None  # (指纹阈值, 时长容差)，None表示不合并重复音频
+        self.duplicates = {}  # 重复片段ID -> 保留的片段ID
+        self.duplicate_groups = []  # [[保留的片段ID, 重复片段ID, ...], ...]
+        self.listeners = []
+        self.lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _scan_dir(self, path):
+        """扫描单个目录（不递归）"""
+        mtime = os.stat(path).st_mtime
+        audio_files = []
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    # 跳过 .git 等隐藏目录
+                    if not entry.name.startswith('.'):
+                        subdirs.append(entry.path)
+                elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                    audio_files.append(entry.path)
+        audio_files.sort()
+        subdirs.sort()
+        return mtime, audio_files, subdirs
+
+    def _scan_tree(self, path):
+        """递归扫描目录树并写入索引"""
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            try:
+                self.dirs[current] = self._scan_dir(current)
+            except OSError:
+                continue
+            pending.extend(self.dirs[current][2])
+
+    def _drop_tree(self, path):
+        """从索引中移除目录及其所有子目录"""
+        prefix = path + os.sep
+        for d in [d for d in self.dirs if d == path or d.startswith(prefix)]:
+            del self.dirs[d]
+
+    def _expand(self, sources):
+        """把源文件展开成片段ID，切分过的文件对应多个片段"""
+        files = []
+        for path in sources:
+            clips = self.clips(self.get_metadata(path))
+            if clips and len(clips) > 1:
+                files.extend(make_clip_id(path, i) for i in range(len(clips)))
+            else:
+                files.append(path)
+        return files
+
+    def _find_duplicates(self, sources):
+        """按分析结果里的指纹把片段分组，更新duplicates和duplicate_groups"""
+        entries = []
+        for clip_id in self._expand(sources):
+            fingerprint = self.clip_fingerprint(clip_id)
+            if fingerprint is not None:
+                entries.append((clip_id,) + fingerprint)
+        threshold, tolerance = self.dedupe
+        self.duplicate_groups = group_duplicates(entries, threshold, tolerance)
+        self.duplicates = {clip_id: group[0] for group in self.duplicate_groups for clip_id in group[1:]}
+
+    def _merge_duplicates(self, files):
+        """重复片段换成各组保留的那个，每组只占一个选择项"""
+        if not self.duplicates:
+            return files
+        merged = dict.fromkeys(self.duplicates.get(f, f) for f in files)
+        return list(merged)
+
+    def _set_selector_items(self, selector, files):
+        weight_func = self.weight_func
+        selector.set_items(files, [weight_func(f) for f in files] if weight_func else None)
+
+    def _rebuild(self):
+        """重建可选列表：优先使用程序目录下的文件，没有时使用所有子目录；切分过的文件展开成片段"""
+        top = self.dirs.get(self.base_dir)
+        if top and top[1]:
+            sources = list(top[1])
+        else:
+            sources = []
+            for d in sorted(self.dirs):
+                sources.extend(self.dirs[d][1])
+        
+        all_sources = []
+        for d in sorted(self.dirs):
+            all_sources.extend(self.dirs[d][1])
+        if self.dedupe:
+            self._find_duplicates(all_sources)
+        else:
+            self.duplicates = {}
+            self.duplicate_groups = []
+        
+        files = self._merge_duplicates(self._expand(sources))
+        self.sources = sources
+        self.files = files
+        self._set_selector_items(self.selector, files)
+        
+        # 声音池从所有目录中按规则挑选
+        pools = {}
+        for name, belongs in self.pool_filters.items():
+            old = self.pools.get(name)
+            selector = old[1] if old else ClipSelector(self.selector.window)
+            pool_files = self._merge_duplicates(self._expand([p for p in all_sources if belongs(p)]))
+            self._set_selector_items(selector, pool_files)
+            pools[name] = (pool_files, selector)
+        self.pools = pools
+
+    def set_pools(self, pool_filters):
+        """设置声音池（名称 -> 过滤函数），可在运行中重新设置"""
+        with self.lock:
+            self.pool_filters = dict(pool_filters)
+            self._rebuild()
+        self._notify()
+
+    def set_weight_func(self, weight_func):
+        """更换权重函数并重建选择器（资源调节在运行中切换）"""
+        with self.lock:
+            self.weight_func = weight_func
+            self._rebuild()
+        self._notify()
+
+    def set_dedupe(self, threshold, tolerance):
+        """开启（threshold为None时关闭）重复音频合并，可在运行中重新设置"""
+        with self.lock:
+            self.dedupe = None if threshold is None else (threshold, tolerance)
+            self._rebuild()
+        self._notify()
+
+    def pool_names(self):
+        return list(self.pools)
+
+    def clear_recent(self):
+        """清空默认列表和所有声音池的不重复窗口"""
+        with self.lock:
+            for selector in [self.selector] + [entry[1] for entry in self.pools.values()]:
+                selector.clear_recent()
+
+    def files_for(self, pool=None):
+        """返回声音池中的片段ID，pool为None或未知时返回默认列表"""
+        entry = self.pools.get(pool) if pool else None
+        return entry[0] if entry else self.files
+
+    def refresh(self):
+        """分析结果变化后重建可选列表，列表有变化时通知监听者"""
+        with self.lock:
+            old_files = (self.files, {name: entry[0] for name, entry in self.pools.items()})
+            self._rebuild()
+            changed = (self.files, {name: entry[0] for name, entry in self.pools.items()}) != old_files
+        if changed:
+            self._notify()
+        return changed
+
+    def scan(self):
+        """完整扫描一次"""
+        with self.lock:
+            self.dirs = {}
+            self._scan_tree(self.base_dir)
+            self._rebuild()
+        self._notify()
+
+    def poll(self):
+        """检查已知目录的修改时间，只重新扫描发生变化的目录"""
+        changed = False
+        with self.lock:
+            for path, (mtime, _, subdirs) in list(self.dirs.items()):
+                if path not in self.dirs:
+                    # 已在本轮中作为子目录被移除
+                    continue
+                try:
+                    current_mtime = os.stat(path).st_mtime
+                except OSError:
+                    self._drop_tree(path)
+                    changed = True
+                    continue
+                if current_mtime == mtime:
+                    continue
+                
+                try:
+                    new_entry = self._scan_dir(path)
+                except OSError:
+                    self._drop_tree(path)
+                    changed = True
+                    continue
+                self.dirs[path] = new_entry
+                for gone in set(subdirs) - set(new_entry[2]):
+                    self._drop_tree(gone)
+                for added in set(new_entry[2]) - set(subdirs):
+                    self._scan_tree(added)
+                changed = True
+            
+            if changed:
+                self._rebuild()
+        
+        if changed:
+            self._notify()
+        return changed
+
+    def _notify(self):
+        for callback in self.listeners:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"音频索引回调错误: {e}")
+
+    def _watch_loop(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"音频索引更新失败: {e}")
+
+    def start_watching(self):
+        """启动后台轮询线程"""
+        if self._thread is None and self.poll_interval > 0:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._watch_loop, daemon=True)
+            self._thread.start()
+
+    def stop_watching(self):
+        """停止后台轮询线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def all_sources(self):
+        """索引中的全部音频文件（包括顶层有文件时不参与默认选择的子文件夹）"""
+        with self.lock:
+            return sorted(f for _, files, _ in self.dirs.values() for f in files)
+
+    def load_metadata(self, path):
+        """从磁盘加载之前保存的分析结果"""
+        self.metadata_path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.metadata = json.load(f)
+        except (OSError, ValueError):
+            self.metadata = {}
+
+    def save_metadata(self):
+        """保存分析结果（先写临时文件再替换）"""
+        if not self.metadata_path:
+            return
+        with self.lock:
+            data = json.dumps(self.metadata, ensure_ascii=False)
+        tmp_path = self.metadata_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.metadata_path)
+        except OSError as e:
+            print(f"保存分析结果失败: {e}")
+
+    def get_metadata(self, path):
+        """返回文件的分析结果，文件修改过或没有分析过时返回None"""
+        info = self.metadata.get(path)
+        if info is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if info.get("mtime") != st.st_mtime or info.get("size") != st.st_size:
+            return None
+        return info
+
+    def set_metadata(self, path, **fields):
+        """合并写入分析结果，文件已变化时丢弃旧字段"""
+        st = os.stat(path)
+        with self.lock:
+            info = self.metadata.get(path)
+            if info is None or info.get("mtime") != st.st_mtime or info.get("size") != st.st_size:
+                info = {"mtime": st.st_mtime, "size": st.st_size}
+            info.update(fields)
+            self.metadata[path] = info
+        return info
+
+    def clips(self, info):
+        """分析结果中可用的裁剪/切分片段；关闭了裁剪或参数已改变时返回None，整个文件播放"""
+        if not info or self.trim is None or info.get("trim") != self.trim:
+            return None
+        return info.get("clips") or None
+
+    def clip_info(self, clip_id):
+        """返回片段的分析结果：切分片段返回该片段自己的信息，否则返回整个文件的信息"""
+        path, index = split_clip_id(clip_id)
+        info = self.get_metadata(path)
+        if info is None or index is None:
+            return info
+        clips = self.clips(info) or []
+        return clips[index] if index < len(clips) else None
+
+    def clip_length(self, clip_id):
+        """片段时长（秒），还没分析过时返回None"""
+        info = self.clip_info(clip_id)
+        if not info:
+            return None
+        return info["end"] - info["start"] if "end" in info else info.get("length")
+
+    def clip_fingerprint(self, clip_id):
+        """返回片段的(指纹, 时长)，还没计算过时返回None"""
+        path, index = split_clip_id(clip_id)
+        info = self.get_metadata(path)
+        if info is None:
+            return None
+        # 裁剪过的文件按实际播放的片段计算指纹
+        clips = self.clips(info)
+        entry = clips[index or 0] if clips else info
+        if "fingerprint" not in entry:
+            return None
+        length = entry["end"] - entry["start"] if clips else entry.get("length", 0.0)
+        return entry["fingerprint"], length
+
+    def pick(self, pool=None):
+        """从声音池中按权重随机选择一个片段，没有文件时返回None"""
+        entry = self.pools.get(pool) if pool else None
+        if pool and entry is None:
+            return None
+        return (entry[1] if entry else self.selector).pick()
+
+def make_pool_filter(base_dir, name, tags):
+    """生成声音池的过滤函数：名称是标签时按文件名通配符匹配，否则视为子文件夹"""
+    if name in tags:
+        patterns = [p.lower() for p in tags[name]]
+        return lambda path: any(fnmatch.fnmatch(os.path.basename(path).lower(), p) for p in patterns)
+    directory = os.path.normcase(os.path.join(base_dir, name)) + os.sep
+    return lambda path: os.path.normcase(path).startswith(directory)
+
+# ========== 随机选择 ==========
+WEIGHT_MODES = ("uniform", "length")
+WEIGHT_REFERENCE_SECONDS = 5.0  # length模式下，长度为此值的片段权重减半
+
+class FenwickTree:
+    """树状数组：O(log n)修改单个权重、按前缀和查找"""
+
+    def __init__(self, weights):
+        n = len(weights)
+        self.size = n
+        self.tree = [0.0] * (n + 1)
+        for i, w in enumerate(weights, 1):
+            self.tree[i] += w
+            parent = i + (i & -i)
+            if parent <= n:
+                self.tree[parent] += self.tree[i]
+        self.top_bit = 1 << (n.bit_length() - 1) if n else 0
+
+    def add(self, index, delta):
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        result = 0.0
+        i = self.size
+        while i > 0:
+            result += self.tree[i]
+            i -= i & -i
+        return result
+
+    def find(self, value):
+        """返回前缀和第一次超过value的下标"""
+        pos = 0
+        step = self.top_bit
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= value:
+                pos = nxt
+                value -= self.tree[nxt]
+            step >>= 1
+        return min(pos, self.size - 1)
+
+class ClipSelector:
+    """带权随机选择，最近选过的N个片段暂时不参与选择（不重复窗口）"""
+
+    def __init__(self, window=DEFAULT_NO_REPEAT_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.items = []
+        self.weights = []
+        self.positive = 0
+        self.recent = deque()  # 最近选中的下标，它们在树中的权重暂时置零
+        self.tree = FenwickTree([])
+        self.updates = 0
+
+    def set_items(self, items, weights=None):
+        """设置候选片段和权重；仍然存在的最近选中项继续留在窗口中"""
+        if weights is None:
+            weights = [1.0] * len(items)
+        with self.lock:
+            recent_items = [self.items[i] for i in self.recent]
+            self.items = list(items)
+            self.weights = [max(0.0, float(w)) for w in weights]
+            self.positive = sum(1 for w in self.weights if w > 0)
+            positions = {item: i for i, item in enumerate(self.items)}
+            self.recent = deque(positions[item] for item in recent_items if item in positions)
+            self._rebuild()
+
+    def clear_recent(self):
+        """清空不重复窗口"""
+        with self.lock:
+            self.recent.clear()
+            self._rebuild()
+
+    def _rebuild(self):
+        current = list(self.weights)
+        for i in self.recent:
+            current[i] = 0.0
+        self.tree = FenwickTree(current)
+        self.updates = 0
+
+    def _effective_window(self):
+        # 至少留一个候选
+        return max(0, min(self.window, self.positive - 1))
+
+    def pick(self):
+        """随机选择一个片段，没有候选时返回None"""
+        with self.lock:
+            if not self.items:
+                return None
+            
+            total = self.tree.total()
+            if total <= 0:
+                # 所有权重都在窗口里（或都为零），清空窗口重新开始
+                self.recent.clear()
+                self._rebuild()
+                total = self.tree.total()
+                if total <= 0:
+                    return random.choice(self.items)
+            
+            index = self.tree.find(random.random() * total)
+            
+            window = self._effective_window()
+            if window > 0:
+                self.tree.add(index, -self.weights[index])
+                self.recent.append(index)
+                while len(self.recent) > window:
+                    released = self.recent.popleft()
+                    self.tree.add(released, self.weights[released])
+                self.updates += 1
+                if self.updates >= 4096:
+                    # 定期重建，避免浮点累计误差
+                    self._rebuild()
+            return self.items[index]
+
+def make_weight_func(library, mode, weights):
+    """生成权重函数：配置里按文件名指定的权重优先，否则按模式计算"""
+    weights = weights or {}
+    
+    def weight(clip_id):
+        for key in (clip_display_name(clip_id), os.path.basename(clip_source(clip_id))):
+            if key in weights:
+                return weights[key]
+        if mode == "length":
+            length = library.clip_length(clip_id)
+            if length is not None:
+                return 1.0 / (1.0 + length / WEIGHT_REFERENCE_SECONDS)
+        return 1.0
+    
+    return weight
+
+# ========== 解码缓存 ==========
+def sound_nbytes(sound):
+    """估算Sound解码后占用的字节数"""
+    frequency, size, channels = mixer.get_init()
+    return int(sound.get_length() * frequency) * channels * (abs(size) // 8)
+
+class SoundCache:
+    """按(路径, 修改时间)缓存已解码的Sound，按解码后总字节数做LRU淘汰"""
+
+    def __init__(self, budget_bytes, loader=None):
+        self.budget_bytes = budget_bytes
+        self.loader = loader or mixer.Sound  # path -> Sound
+        self.entries = OrderedDict()  # (path, mtime) -> (sound, nbytes)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0  # 每次清空加一，丢弃清空前开始的解码结果
+        self.lock = threading.RLock()
+
+    def get(self, path):
+        """获取已解码的Sound，未命中时解码并放入缓存（可在后台线程调用）"""
+        mtime = os.path.getmtime(clip_source(path))
+        key = (path, mtime)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self.generation
+        
+        # 解码不持锁，多个解码线程可以并行
+        sound = self.loader(path)
+        with self.lock:
+            if generation == self.generation:
+                self._put(key, sound)
+        return sound
+
+    def put(self, key, sound):
+        """放入缓存，同一路径的旧版本会被替换"""
+        with self.lock:
+            self._put(key, sound)
+
+    def _put(self, key, sound):
+        path = key[0]
+        for old_key in [k for k in self.entries if k[0] == path]:
+            self.discard(old_key)
+        
+        nbytes = sound_nbytes(sound)
+        if nbytes > self.budget_bytes:
+            # 单个文件超出预算，不缓存
+            return
+        
+        self.entries[key] = (sound, nbytes)
+        self.total_bytes += nbytes
+        self._evict_to_budget()
+
+    def _evict_to_budget(self):
+        while self.total_bytes > self.budget_bytes and self.entries:
+            oldest_key = next(iter(self.entries))
+            self.discard(oldest_key)
+            self.evictions += 1
+
+    def set_budget(self, budget_bytes):
+        """修改内存预算，超出部分立即按LRU淘汰"""
+        with self.lock:
+            self.budget_bytes = budget_bytes
+            self._evict_to_budget()
+
+    def discard(self, key):
+        """移除一个缓存项"""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+
+    def discard_source(self, path):
+        """移除某个源文件的所有片段（裁剪/切分结果变化后调用）"""
+        with self.lock:
+            for key in [k for k in self.entries if clip_source(k[0]) == path]:
+                self.discard(key)
+
+    def clear(self):
+        """清空缓存"""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.generation += 1
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else None,
+                "evictions": self.evictions,
+            }
+
+# ========== 磁盘PCM缓存 ==========
+def file_digest(path):
+    """计算文件内容的SHA-1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class PcmDiskCache:
+    """把音频预先转码成mixer格式的原始PCM保存在磁盘上，加载时直接内存映射
+
+    索引记录每个源文件的修改时间、大小和内容哈希；PCM文件按内容哈希和采样格式命名，
+    源文件改变后旧的PCM文件会在重建时被清理。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        self.index = {}  # 源文件路径 -> {"mtime", "size", "hash"}
+        self.hits = 0
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _pcm_path(self, digest):
+        frequency, size, channels = mixer.get_init()
+        return os.path.join(self.cache_dir, f"{digest}_{frequency}_{size}_{channels}.pcm")
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def lookup(self, path):
+        """返回仍然有效的PCM缓存文件路径，没有时返回None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.index.get(path)
+        if not entry or entry["mtime"] != st.st_mtime or entry["size"] != st.st_size:
+            return None
+        pcm_path = self._pcm_path(entry["hash"])
+        if not os.path.exists(pcm_path):
+            return None
+        return pcm_path
+
+    def load(self, path):
+        """从缓存加载Sound，缓存无效时直接解码源文件"""
+        pcm_path = self.lookup(path)
+        if pcm_path is not None:
+            try:
+                with open(pcm_path, 'rb') as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        sound = mixer.Sound(buffer=mm)
+                self.hits += 1
+                return sound
+            except (OSError, ValueError) as e:
+                print(f"PCM缓存读取失败: {pcm_path}: {e}")
+        return mixer.Sound(path)
+
+    def update(self, path):
+        """确保某个源文件有最新的PCM缓存，返回是否进行了转码"""
+        if self.lookup(path) is not None:
+            return False
+        
+        st = os.stat(path)
+        digest = file_digest(path)
+        pcm_path = self._pcm_path(digest)
+        transcoded = False
+        if not os.path.exists(pcm_path):
+            # 同样内容的文件（改名或只改了时间）可以直接复用已有的PCM
+            raw = mixer.Sound(path).get_raw()
+            tmp_path = pcm_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, pcm_path)
+            transcoded = True
+        
+        with self.lock:
+            self.index[path] = {"mtime": st.st_mtime, "size": st.st_size, "hash": digest}
+        return transcoded
+
+    def build(self, paths, progress=None):
+        """为所有文件生成缓存，清理失效的条目，progress(已完成, 总数)用于报告进度"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        total = len(paths)
+        for i, path in enumerate(paths):
+            try:
+                # 切换延迟档位会重新初始化mixer：PCM文件名里的采样格式和转码必须在同一次进入中取得
+                with mixer_gate.use():
+                    self.update(path)
+            except Exception as e:
+                print(f"PCM缓存生成失败: {path}: {e}")
+            if progress:
+                progress(i + 1, total)
+        
+        with mixer_gate.use(), self.lock:
+            valid = set(paths)
+            for path in [p for p in self.index if p not in valid]:
+                del self.index[path]
+            self._save_index()
+            self.prune()
+
+    def prune(self):
+        """删除当前格式下不再被索引引用的PCM文件"""
+        if mixer.get_init() is None:
+            return
+        referenced = {os.path.basename(self._pcm_path(e["hash"])) for e in self.index.values()}
+        suffix = os.path.basename(self._pcm_path(""))
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(suffix) and name not in referenced:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+# ========== 响度分析 ==========
+LOUDNESS_BLOCK_SECONDS = 0.4  # 响度按400ms分块统计
+LOUDNESS_GATE_DB = -70.0  # 低于此电平的块不计入响度
+PEAK_CEILING_DB = -1.0  # 归一化后峰值不超过此电平
+SILENCE_DB = -120.0
+
+def sound_samples(sound):
+    """把Sound转换成范围在[-1, 1]的float32数组，形状为(采样数, 声道数)"""
+    import numpy as np
+    from pygame import sndarray
+    
+    samples = sndarray.array(sound)
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    _, size, _ = mixer.get_init()
+    return samples.astype(np.float32) / float(1 << (abs(size) - 1))
+
+def power_to_db(power):
+    import math
+    return 10 * math.log10(power) if power > 0 else SILENCE_DB
+
+def measure_loudness(samples, frequency):
+    """计算峰值、RMS和门限响度（dBFS）
+
+    响度按BS.1770的思路分块求均方并做绝对门限，省略了K计权滤波。
+    """
+    import numpy as np
+    
+    if samples.size == 0:
+        return {"peak_db": SILENCE_DB, "rms_db": SILENCE_DB, "loudness_db": SILENCE_DB}
+    
+    power = np.mean(samples * samples, axis=1)
+    peak = float(np.max(np.abs(samples)))
+    
+    block = max(1, int(frequency * LOUDNESS_BLOCK_SECONDS))
+    n_blocks = len(power) // block
+    if n_blocks:
+        block_power = power[:n_blocks * block].reshape(n_blocks, block).mean(axis=1)
+        gated = block_power[block_power > 10 ** (LOUDNESS_GATE_DB / 10)]
+        loudness_power = float(gated.mean()) if gated.size else 0.0
+    else:
+        loudness_power = float(power.mean())
+    
+    return {
+        "peak_db": float(20 * np.log10(peak)) if peak > 0 else SILENCE_DB,
+        "rms_db": power_to_db(float(power.mean())),
+        "loudness_db": power_to_db(loudness_power),
+    }
+
+def db_to_gain(db):
+    return 10 ** (db / 20)
+
+def normalization_gain(info, target_db):
+    """根据分析结果计算音量系数；Sound.set_volume不能放大，所以只做衰减"""
+    if not info or "loudness_db" not in info:
+        return 1.0
+    gain = db_to_gain(target_db - info["loudness_db"])
+    gain = min(gain, db_to_gain(PEAK_CEILING_DB - info["peak_db"]))
+    return max(0.0, min(1.0, gain))
+
+# ========== 静音裁剪与切分 ==========
+SILENCE_FRAME_SECONDS = 0.01  # 按10ms帧判断静音
+SILENCE_PAD_SECONDS = 0.02  # 裁剪时在有声部分两侧保留的余量
+MIN_CLIP_SECONDS = 0.1  # 短于此长度的片段丢弃
+
+class TrimOptions:
+    """静音裁剪与切分参数"""
+
+    def __init__(self, enabled=True, threshold_db=DEFAULT_SILENCE_THRESHOLD_DB, split=True,
+                 split_min_seconds=DEFAULT_SPLIT_MIN_SECONDS, split_min_gap=DEFAULT_SPLIT_MIN_GAP_SECONDS):
+        self.enabled = enabled
+        self.threshold_db = threshold_db
+        self.split = split
+        self.split_min_seconds = split_min_seconds
+        self.split_min_gap = split_min_gap
+
+    def signature(self):
+        """参数签名，参数改变后缓存的裁剪结果失效"""
+        if not self.enabled:
+            return None
+        return [self.threshold_db, self.split, self.split_min_seconds, self.split_min_gap]
+
+def trim_options_from_config(config):
+    """按配置生成静音裁剪与切分选项"""
+    return TrimOptions(enabled=config.get("trim_silence", True),
+                       threshold_db=config.get("silence_threshold_db", DEFAULT_SILENCE_THRESHOLD_DB),
+                       split=config.get("split_clips", True),
+                       split_min_seconds=config.get("split_min_seconds", DEFAULT_SPLIT_MIN_SECONDS),
+                       split_min_gap=config.get("split_min_gap_seconds", DEFAULT_SPLIT_MIN_GAP_SECONDS))
+
+def find_clips(samples, frequency, options):
+    """找出有声部分，返回[(开始秒, 结束秒), ...]
+
+    首尾低于阈值的静音会被裁掉；足够长的文件在静音间隙处切分成多个片段。
+    """
+    import numpy as np
+    
+    total = len(samples)
+    frame = max(1, int(frequency * SILENCE_FRAME_SECONDS))
+    n_frames = (total + frame - 1) // frame
+    if n_frames == 0:
+        return [(0.0, 0.0)]
+    
+    padded = np.zeros((n_frames * frame, samples.shape[1]), dtype=np.float32)
+    padded[:total] = samples
+    frame_power = np.mean((padded * padded).reshape(n_frames, -1), axis=1)
+    loud = np.flatnonzero(frame_power > 10 ** (options.threshold_db / 10))
+    if loud.size == 0:
+        # 整个文件都低于阈值，保持原样
+        return [(0.0, total / frequency)]
+    
+    if options.split and total / frequency >= options.split_min_seconds:
+        gap_frames = max(1, int(options.split_min_gap / SILENCE_FRAME_SECONDS))
+        breaks = np.flatnonzero(np.diff(loud) > gap_frames)
+        starts = np.concatenate(([loud[0]], loud[breaks + 1]))
+        ends = np.concatenate((loud[breaks], [loud[-1]]))
+    else:
+        starts = loud[:1]
+        ends = loud[-1:]
+    
+    pad = int(SILENCE_PAD_SECONDS * frequency)
+    clips = []
+    for start, end in zip(starts, ends):
+        begin = max(0, int(start) * frame - pad)
+        finish = min(total, (int(end) + 1) * frame + pad)
+        if (finish - begin) / frequency >= MIN_CLIP_SECONDS:
+            clips.append((begin / frequency, finish / frequency))
+    if not clips:
+        clips.append((int(loud[0]) * frame / frequency, min(total, (int(loud[-1]) + 1) * frame) / frequency))
+    return clips
+
+def analyze_file(library, path, loader, trim_options=None):
+    """解码并分析一个文件（响度、静音裁剪、切分），结果写入音频索引"""
+    sound = loader(path)
+    frequency = mixer.get_init()[0]
+    samples = sound_samples(sound)
+    fields = measure_loudness(samples, frequency)
+    fields["length"] = sound.get_length()
+    fields["fingerprint"] = audio_fingerprint(samples)
+    
+    if trim_options is not None and trim_options.enabled:
+        clips = []
+        for start, end in find_clips(samples, frequency, trim_options):
+            clip = {"start": start, "end": end}
+            clip_samples = samples[int(start * frequency):int(end * frequency)]
+            clip.update(measure_loudness(clip_samples, frequency))
+            clip["fingerprint"] = audio_fingerprint(clip_samples)
+            clips.append(clip)
+        fields["clips"] = clips
+        fields["trim"] = trim_options.signature()
+    return library.set_metadata(path, **fields)
+
+def needs_analysis(info, normalize, trim_options, fingerprint=False):
+    """判断文件是否需要（重新）分析"""
+    if info is None:
+        return True
+    if normalize and "loudness_db" not in info:
+        return True
+    if fingerprint and "fingerprint" not in info:
+        return True
+    if trim_options.enabled and info.get("trim") != trim_options.signature():
+        return True
+    return False
+
+class ClipLoader:
+    """按音频索引里的裁剪/切分结果加载片段，作为SoundCache的加载函数"""
+
+    def __init__(self, library, source_loader, pcm_cache=None, sample_bank=None):
+        self.library = library
+        self.source_loader = source_loader
+        self.pcm_cache = pcm_cache
+        self.sample_bank = sample_bank
+        self.lock = threading.Lock()
+        self._last = (None, None, None)  # 最近解码的(路径, mtime, PCM数据)，切分片段连续加载时复用
+
+    def _source_pcm(self, path):
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            last_path, last_mtime, raw = self._last
+            if last_path == path and last_mtime == mtime:
+                return raw
+        raw = self.source_loader(path).get_raw()
+        with self.lock:
+            self._last = (path, mtime, raw)
+        return raw
+
+    def __call__(self, clip_id):
+        path, index = split_clip_id(clip_id)
+        clips = self.library.clips(self.library.get_metadata(path))
+        if not clips:
+            return self.source_loader(path)
+        clip = clips[index or 0]
+        
+        frequency, size, channels = mixer.get_init()
+        frame_bytes = channels * (abs(size) // 8)
+        start = int(clip["start"] * frequency) * frame_bytes
+        end = int(clip["end"] * frequency) * frame_bytes
+        
+        data = self.sample_bank.pcm(path) if self.sample_bank else None
+        if data is not None:
+            self.sample_bank.hits += 1
+            return mixer.Sound(buffer=data[start:end])
+        pcm_path = self.pcm_cache.lookup(path) if self.pcm_cache else None
+        if pcm_path is not None:
+            # 直接从内存映射的PCM文件截取，不需要解码整个文件
+            with open(pcm_path, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return mixer.Sound(buffer=mm[start:end])
+        return mixer.Sound(buffer=memoryview(self._source_pcm(path))[start:end])
+
+# ========== 重复音频检测 ==========
+FINGERPRINT_POINTS = 64  # 能量包络降采样到的点数
+FINGERPRINT_LEVELS = 16  # 每个点量化成一位十六进制数
+
+def audio_fingerprint(samples):
+    """解码后PCM的指纹：能量包络降采样到固定点数，按最大值归一化后量化成十六进制串
+
+    只看包络形状，和音量、采样格式、编码方式无关，同一个声音的MP3和OGG版本指纹相同或非常接近。
+    """
+    import numpy as np
+    
+    if len(samples) == 0:
+        return "0" * FINGERPRINT_POINTS
+    energy = np.sqrt(np.mean(samples * samples, axis=1, dtype=np.float64))
+    edges = np.linspace(0, len(energy), FINGERPRINT_POINTS + 1).astype(int)
+    total = np.concatenate(([0.0], np.cumsum(energy)))
+    envelope = (total[edges[1:]] - total[edges[:-1]]) / np.maximum(edges[1:] - edges[:-1], 1)
+    peak = envelope.max()
+    if peak > 0:
+        envelope = envelope / peak
+    levels = np.minimum((envelope * FINGERPRINT_LEVELS).astype(int), FINGERPRINT_LEVELS - 1)
+    return "".join(f"{level:x}" for level in levels)
+
+def fingerprint_distance(a, b):
+    """两个指纹的平均差异，0表示完全相同，1表示完全不同"""
+    return sum(abs(int(x, 16) - int(y, 16)) for x, y in zip(a, b)) / (len(a) * (FINGERPRINT_LEVELS - 1))
+
+def group_duplicates(entries, threshold, tolerance):
+    """把[(片段ID, 指纹, 时长)]中互相重复的片段分组，只返回多于一个片段的组
+
+    按时长排序后只和时长相近的片段比较指纹；相似关系按传递合并。每组第一个是保留的片段，
+    取排序后最靠前的ID，结果稳定。
+    """
+    entries = sorted(entries, key=lambda entry: entry[2])
+    parent = list(range(len(entries)))
+    
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    for i, (_, fingerprint, length) in enumerate(entries):
+        limit = length * (1 + tolerance) + 0.01
+        for j in range(i + 1, len(entries)):
+            if entries[j][2] > limit:
+                break
+            if fingerprint_distance(fingerprint, entries[j][1]) <= threshold:
+                parent[root(j)] = root(i)
+    
+    groups = {}
+    for i, entry in enumerate(entries):
+        groups.setdefault(root(i), []).append(entry[0])
+    return sorted(sorted(group) for group in groups.values() if len(group) > 1)
+
+def duplicate_report(library):
+    """列出重复音频分组和合并后少占用的解码内存（按当前混音器格式估算）"""
+    frequency, size, channels = (mixer.get_init() if mixer else None) or (44100, -16, 2)
+    frame_bytes = channels * (abs(size) // 8)
+    groups = []
+    saved = 0
+    for group in library.duplicate_groups:
+        fingerprint, _ = library.clip_fingerprint(group[0])
+        members = []
+        for clip_id in group[1:]:
+            other, length = library.clip_fingerprint(clip_id)
+            nbytes = int(length * frequency) * frame_bytes
+            saved += nbytes
+            members.append({"clip": clip_id, "exact": other == fingerprint, "bytes": nbytes,
+                            "distance": round(fingerprint_distance(fingerprint, other), 4)})
+        groups.append({"keep": group[0], "duplicates": members})
+    return {"groups": groups, "merged_clips": sum(len(g["duplicates"]) for g in groups), "saved_bytes": saved}
+
+def format_duplicate_report(report, base_dir):
+    """把重复音频报告整理成文本"""
+    def name(clip_id):
+        path, index = split_clip_id(clip_id)
+        text = os.path.relpath(path, base_dir)
+        return text if index is None else f"{text} #{index + 1}"
+    
+    if not report["groups"]:
+        return "没有发现重复音频"
+    lines = [f"发现 {len(report['groups'])} 组重复音频，合并 {report['merged_clips']} 个片段，"
+             f"节省解码内存 {report['saved_bytes'] / 1024 / 1024:.1f} MB"]
+    for group in report["groups"]:
+        lines.append(f"保留: {name(group['keep'])}")
+        for item in group["duplicates"]:
+            kind = "完全相同" if item["exact"] else f"近似 {item['distance']:.3f}"
+            lines.append(f"  重复: {name(item['clip'])}  ({kind}, {item['bytes'] / 1024:.0f} KB)")
+    return "\n".join(lines)
+
+# ========== 变调变速 ==========
+def resample_sound(sound, ratio):
+    """按比例重采样（同时改变音高和速度，像改变磁带转速），ratio>1时音调变高、时长变短"""
+    import numpy as np
+    from pygame import sndarray
+    
+    samples = sndarray.array(sound)
+    n = samples.shape[0]
+    if n < 2:
+        return sound
+    positions = np.arange(0, n - 1, ratio)
+    left = positions.astype(np.int64)
+    frac = (positions - left).astype(np.float32)
+    if samples.ndim > 1:
+        frac = frac[:, np.newaxis]
+    a = samples[left].astype(np.float32)
+    b = samples[left + 1].astype(np.float32)
+    out = a + (b - a) * frac
+    return sndarray.make_sound(np.ascontiguousarray(out.round().astype(samples.dtype)))
+
+def variant_ratios(semitones, count):
+    """在[-semitones, +semitones]范围内均匀取count个变调比例（不含原调）"""
+    if count <= 0 or semitones <= 0:
+        return []
+    if count == 1:
+        steps = [semitones]
+    else:
+        steps = [-semitones + 2 * semitones * i / (count - 1) for i in range(count)]
+    return [2 ** (step / 12) for step in steps if abs(step) > 1e-3]
+
+class VariantCache:
+    """每个片段预先生成若干个变调变速版本，播放时随机选一个（或原声）
+
+    生成在后台线程中进行，按键时只查表；还没生成好时直接播放原声。
+    按片段整组做LRU淘汰，总字节数不超过预算。
+    """
+
+    def __init__(self, budget_bytes, semitones=DEFAULT_PITCH_VARIATION_SEMITONES,
+                 count=DEFAULT_PITCH_VARIANTS, workers=1):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (片段ID, mtime) -> ([Sound], 字节数)
+        self.pending = set()
+        self.total_bytes = 0
+        self.generation = 0  # clear()后丢弃之前提交的生成结果
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.inline = False  # 离线渲染时在pick的调用线程中生成，结果不受后台线程时序影响
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="variant")
+        self.configure(budget_bytes, semitones, count)
+
+    @property
+    def enabled(self):
+        return bool(self.ratios)
+
+    def configure(self, budget_bytes, semitones, count):
+        """修改预算、变调范围和数量；范围或数量变化时丢弃已生成的版本"""
+        ratios = variant_ratios(semitones, count)
+        with self.lock:
+            self.budget_bytes = budget_bytes
+            changed = ratios != getattr(self, "ratios", None)
+            self.ratios = ratios
+        if changed:
+            self.clear()
+        else:
+            with self.lock:
+                self._evict_to_budget()
+
+    def _key(self, clip_id):
+        try:
+            return clip_id, os.path.getmtime(clip_source(clip_id))
+        except OSError:
+            return None
+
+    def prepare(self, clip_id, sound):
+        """确保片段的变调版本已生成或正在生成（预取解码完成后调用）"""
+        if not self.enabled or self.inline:
+            return
+        key = self._key(clip_id)
+        with self.lock:
+            if key is None or key in self.entries or key in self.pending:
+                return
+            self.pending.add(key)
+            generation = self.generation
+            ratios = self.ratios
+        self.executor.submit(self._generate, key, sound, ratios, generation)
+
+    def _generate(self, key, sound, ratios, generation):
+        with mixer_gate.use():
+            try:
+                variants = [resample_sound(sound, ratio) for ratio in ratios]
+            except Exception as e:
+                print(f"生成变调版本失败: {key[0]}: {e}")
+                variants = None
+            with self.lock:
+                self.pending.discard(key)
+                if not variants or generation != self.generation:
+                    return
+                nbytes = sum(sound_nbytes(v) for v in variants)
+                if nbytes > self.budget_bytes:
+                    return
+                self.entries[key] = (variants, nbytes)
+                self.total_bytes += nbytes
+                self._evict_to_budget()
+
+    def _evict_to_budget(self):
+        while self.total_bytes > self.budget_bytes and self.entries:
+            _, (_, nbytes) = self.entries.popitem(last=False)
+            self.total_bytes -= nbytes
+            self.evictions += 1
+
+    def pick(self, clip_id, sound):
+        """随机返回一个变调版本或原声；还没有生成时返回原声并在后台生成"""
+        if not self.enabled:
+            return sound
+        key = self._key(clip_id)
+        if self.inline and key is not None:
+            with self.lock:
+                missing = key not in self.entries
+                ratios, generation = self.ratios, self.generation
+            if missing:
+                self._generate(key, sound, ratios, generation)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                variants = entry[0]
+                choice = random.randrange(len(variants) + 1)
+                return variants[choice] if choice < len(variants) else sound
+            self.misses += 1
+        self.prepare(clip_id, sound)
+        return sound
+
+    def set_budget(self, budget_bytes):
+        with self.lock:
+            self.budget_bytes = budget_bytes
+            self._evict_to_budget()
+
+    def discard_source(self, path):
+        """丢弃某个源文件所有片段的变调版本（裁剪/切分结果变化后调用）"""
+        with self.lock:
+            for key in [k for k in self.entries if clip_source(k[0]) == path]:
+                self.total_bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.pending.clear()
+            self.total_bytes = 0
+            self.generation += 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "variants_per_clip": len(self.ratios),
+                "clips": len(self.entries),
+                "bytes": self.total_bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+# ========== 采样库 ==========
+BANK_MAGIC = b"TRBANK01"
+BANK_ALIGN = 4096
+
+class SampleBank:
+    """单文件采样库：整个音频库预先解码成mixer格式的PCM，连续存放在一个文件里
+
+    文件格式：8字节标识、4字节小端JSON索引长度、JSON索引（采样格式、数据起始位置、
+    每个源文件的相对路径/mtime/大小/哈希/偏移/长度/分析结果），之后是按BANK_ALIGN对齐的PCM数据。
+    运行时整个文件只做一次内存映射，Sound直接从映射的切片创建。
+    """
+
+    def __init__(self, path, base_dir, fallback=None):
+        self.path = path
+        self.fallback = fallback  # 采样库里没有（或已过期）时的加载函数
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(BANK_MAGIC)] != BANK_MAGIC:
+            self.mm.close()
+            raise ValueError("不是采样库文件")
+        header_len = struct.unpack_from("<I", self.mm, len(BANK_MAGIC))[0]
+        start = len(BANK_MAGIC) + 4
+        header = json.loads(bytes(self.mm[start:start + header_len]).decode('utf-8'))
+        self.format = tuple(header["format"])  # (采样率, 位深, 声道数)，和mixer.get_init()一致
+        self.data_offset = header["data_offset"]
+        self.entries = {os.path.join(base_dir, *entry["path"].split("/")): entry for entry in header["entries"]}
+        self.view = memoryview(self.mm)
+        self.valid = {}  # 源文件路径 -> ((mtime, size), 是否与采样库一致)
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def _is_valid(self, path, entry):
+        """源文件和打包时一致：mtime和大小相同，或者大小相同且内容哈希相同（复制后mtime会变）"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        key = (st.st_mtime, st.st_size)
+        with self.lock:
+            cached = self.valid.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        valid = entry["size"] == st.st_size and (entry["mtime"] == st.st_mtime or entry["hash"] == file_digest(path))
+        with self.lock:
+            self.valid[path] = (key, valid)
+        return valid
+
+    def pcm(self, path):
+        """源文件的PCM数据（内存映射的切片，不复制）；不在采样库中、已过期或采样格式不同时返回None"""
+        entry = self.entries.get(path)
+        if entry is None or mixer.get_init() != self.format or not self._is_valid(path, entry):
+            return None
+        start = self.data_offset + entry["offset"]
+        return self.view[start:start + entry["length"]]
+
+    def load(self, path):
+        """从采样库创建Sound（pygame在构造时复制一份数据），不可用时交给fallback"""
+        data = self.pcm(path)
+        if data is not None:
+            self.hits += 1
+            return mixer.Sound(buffer=data)
+        return (self.fallback or mixer.Sound)(path)
+
+    def seed_metadata(self, library):
+        """把采样库里的分析结果写入音频索引，已有有效结果的文件不覆盖"""
+        seeded = 0
+        for path, entry in self.entries.items():
+            if entry.get("metadata") and library.get_metadata(path) is None and self._is_valid(path, entry):
+                library.set_metadata(path, **entry["metadata"])
+                seeded += 1
+        return seeded
+
+def write_sample_bank(out_path, base_dir, trim_options=None, progress=None):
+    """扫描base_dir下的全部音频，解码、分析后写成采样库（需要先初始化mixer），返回打包的文件数"""
+    library = AudioLibrary(base_dir, 0)
+    library.scan()
+    paths = library.all_sources()
+    frequency, size, channels = mixer.get_init()
+    
+    entries = []
+    data_path = out_path + ".data"
+    tmp_path = out_path + ".tmp"
+    try:
+        offset = 0
+        with open(data_path, 'wb') as data:
+            for i, path in enumerate(paths):
+                if progress:
+                    progress(i + 1, len(paths), path)
+                try:
+                    sound = mixer.Sound(path)
+                except Exception as e:
+                    print(f"跳过无法解码的文件: {path}: {e}")
+                    continue
+                raw = sound.get_raw()
+                info = analyze_file(library, path, lambda _: sound, trim_options)
+                st = os.stat(path)
+                entries.append({
+                    "path": os.path.relpath(path, base_dir).replace(os.sep, "/"),
+                    "mtime": st.st_mtime,
+                    "size": st.st_size,
+                    "hash": file_digest(path),
+                    "offset": offset,
+                    "length": len(raw),
+                    "metadata": {k: v for k, v in info.items() if k not in ("mtime", "size")},
+                })
+                data.write(raw)
+                offset += len(raw)
+    
+        header = {"version": 1, "format": [frequency, size, channels], "entries": entries}
+        # 数据起始位置取决于索引长度，索引里又要写入数据起始位置，按对齐后的长度反复计算直到稳定
+        data_offset = 0
+        while True:
+            header["data_offset"] = data_offset
+            encoded = json.dumps(header, ensure_ascii=False).encode('utf-8')
+            needed = -(-(len(BANK_MAGIC) + 4 + len(encoded)) // BANK_ALIGN) * BANK_ALIGN
+            if needed == data_offset:
+                break
+            data_offset = needed
+    
+        with open(tmp_path, 'wb') as f:
+            f.write(BANK_MAGIC)
+            f.write(struct.pack("<I", len(encoded)))
+            f.write(encoded)
+            f.write(b"\0" * (data_offset - f.tell()))
+            with open(data_path, 'rb') as data:
+                shutil.copyfileobj(data, f, 1024 * 1024)
+        os.replace(tmp_path, out_path)
+    finally:
+        # 解码或写入失败时不留下半成品
+        for leftover in (data_path, tmp_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return len(entries)
+
+def open_sample_bank(path, base_dir, fallback=None):
+    """打开采样库，文件不存在或损坏时返回None"""
+    if not os.path.exists(path):
+        return None
+    try:
+        bank = SampleBank(path, base_dir, fallback)
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        print(f"采样库无法使用: {path}: {e}")
+        return None
+    if bank.format != mixer.get_init():
+        print(f"采样库的采样格式 {bank.format} 与混音器 {mixer.get_init()} 不同，将直接解码源文件")
+    print(f"已加载采样库: {len(bank.entries)}个文件")
+    return bank
+
+# ========== 流式播放 ==========
+class StreamSource:
+    """长片段的流式播放：预取时不解码，播放时按块截取PCM，通过Channel.queue接续
+
+    reader为"bank"时从采样库的内存映射切片读取，为"pcm"时从磁盘PCM缓存内存映射读取，
+    为"wav"时直接读取格式与mixer一致的WAV，为None时没有可以分块读取的数据，
+    只能整个文件交给mixer.music播放。
+    """
+
+    def __init__(self, clip_id, reader, source, start, end, chunk_seconds):
+        self.clip_id = clip_id
+        self.path = clip_source(clip_id)
+        self.reader = reader
+        self.source = source  # "bank"时为PCM数据，"pcm"时为PCM缓存文件路径
+        self.start = start  # 秒
+        self.end = end  # 秒，None表示到文件末尾
+        self.chunk_seconds = chunk_seconds
+        self.volume = 1.0
+
+    def set_volume(self, volume):
+        """和Sound.set_volume一样设置音量，对之后生成的每一块生效"""
+        self.volume = volume
+
+    def get_volume(self):
+        return self.volume
+
+    def get_length(self):
+        """已知的片段时长（秒），没有结束位置时返回0"""
+        return self.end - self.start if self.end is not None else 0.0
+
+    def _chunk(self, data):
+        sound = mixer.Sound(buffer=data)
+        sound.set_volume(self.volume)
+        return sound
+
+    def _slices(self, data, start_frame, end_frame, chunk_frames, frame_bytes):
+        end = len(data) if end_frame is None else min(len(data), end_frame * frame_bytes)
+        for offset in range(start_frame * frame_bytes, end, chunk_frames * frame_bytes):
+            yield self._chunk(data[offset:min(end, offset + chunk_frames * frame_bytes)])
+
+    def chunks(self):
+        """生成器：依次产生每一块的Sound，最多只有正在播放和排队中的两块在内存中"""
+        frequency, size, channels = mixer.get_init()
+        frame_bytes = channels * (abs(size) // 8)
+        chunk_frames = max(1, int(self.chunk_seconds * frequency))
+        start_frame = int(self.start * frequency)
+        end_frame = None if self.end is None else int(self.end * frequency)
+        
+        if self.reader == "bank":
+            yield from self._slices(self.source, start_frame, end_frame, chunk_frames, frame_bytes)
+        elif self.reader == "pcm":
+            with open(self.source, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    yield from self._slices(mm, start_frame, end_frame, chunk_frames, frame_bytes)
+        elif self.reader == "wav":
+            with wave.open(self.path, 'rb') as f:
+                f.setpos(min(start_frame, f.getnframes()))
+                remaining = f.getnframes() - start_frame if end_frame is None else end_frame - start_frame
+                while remaining > 0:
+                    data = f.readframes(min(chunk_frames, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data) // frame_bytes
+                    yield self._chunk(data)
+
+def wav_matches_mixer(path):
+    """WAV文件的采样格式是否和mixer一致（一致时可以不经转换直接分块读取）"""
+    frequency, size, channels = mixer.get_init()
+    try:
+        with wave.open(path, 'rb') as f:
+            return (f.getframerate() == frequency and f.getnchannels() == channels
+                    and f.getsampwidth() == abs(size) // 8 and size == -16)
+    except (OSError, EOFError, wave.Error):
+        return False
+
+class StreamPlanner:
+    """判断一个片段是否应该流式播放，是则返回StreamSource，否则返回None
+
+    片段时长已知（分析过）时按时长判断，否则按源文件大小判断。
+    """
+
+    def __init__(self, library, pcm_cache=None, min_seconds=DEFAULT_STREAM_MIN_SECONDS,
+                 min_mb=DEFAULT_STREAM_MIN_MB, chunk_seconds=DEFAULT_STREAM_CHUNK_SECONDS, sample_bank=None):
+        self.library = library
+        self.pcm_cache = pcm_cache
+        self.sample_bank = sample_bank
+        self.min_seconds = min_seconds
+        self.min_bytes = int(min_mb * 1024 * 1024)
+        self.chunk_seconds = max(0.5, chunk_seconds)
+
+    def __call__(self, clip_id):
+        path, index = split_clip_id(clip_id)
+        info = self.library.get_metadata(path)
+        clips = self.library.clips(info)
+        if clips:
+            clip = clips[index or 0]
+            start, end = clip["start"], clip["end"]
+            length = end - start
+        else:
+            start, end = 0.0, None
+            length = info.get("length") if info else None
+        
+        if length is not None:
+            if length < self.min_seconds:
+                return None
+        else:
+            try:
+                if os.path.getsize(path) < self.min_bytes:
+                    return None
+            except OSError:
+                return None
+        
+        bank_data = self.sample_bank.pcm(path) if self.sample_bank else None
+        pcm_path = self.pcm_cache.lookup(path) if self.pcm_cache and bank_data is None else None
+        if bank_data is not None:
+            reader, source = "bank", bank_data
+        elif pcm_path is not None:
+            reader, source = "pcm", pcm_path
+        elif path.lower().endswith(".wav") and wav_matches_mixer(path):
+            reader, source = "wav", None
+        elif index is None:
+            reader, source = None, None
+        else:
+            # 切分出来的片段不能交给mixer.music（无法在片段结尾停止），整体解码
+            return None
+        return StreamSource(clip_id, reader, source, start, end, self.chunk_seconds)
+
+# ========== 后台解码与预取 ==========
+class DecodePool:
+    """后台解码线程池：为每个声音池提前选好接下来要播放的文件并解码好，按键时直接播放"""
+
+    def __init__(self, library, cache, depth=DEFAULT_PREFETCH_DEPTH, workers=DEFAULT_DECODE_WORKERS):
+        self.library = library
+        self.cache = cache
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="decode")
+        self.pending = {}  # 声音池名称(None为默认) -> deque[(片段ID, future)]，按选择顺序排列
+        self.lock = threading.Lock()
+        self.ready_hits = 0  # 按键时已解码完成的次数
+        self.waits = 0  # 按键时仍需等待解码的次数
+        self.closed = False
+        self.stream_planner = None  # 判断是否流式播放的函数，返回StreamSource或None
+        self.variants = None  # VariantCache，解码完成后在后台生成变调版本
+        self.fifo = False  # 离线渲染时严格按选择顺序取出，不优先取先解码完成的
+
+    def _load(self, clip_id):
+        """在解码线程中执行：长片段返回StreamSource（不解码），其余从缓存取或解码"""
+        with mixer_gate.use():
+            if self.stream_planner is not None:
+                stream = self.stream_planner(clip_id)
+                if stream is not None:
+                    return stream
+            sound = self.cache.get(clip_id)
+            if self.variants is not None:
+                self.variants.prepare(clip_id, sound)
+            return sound
+
+    def fill(self, pool=None):
+        """补足预取队列；pool为None时补足所有声音池"""
+        pools = [pool] if pool is not None else [None] + self.library.pool_names()
+        with self.lock:
+            for name in pools:
+                prefetched = self.pending.setdefault(name, deque())
+                while not self.closed and len(prefetched) < self.depth:
+                    path = self.library.pick(name)
+                    if path is None:
+                        break
+                    prefetched.append((path, self.executor.submit(self._load, path)))
+
+    def take(self, pool=None):
+        """取出声音池中下一个要播放的(片段ID, Future)；没有可用文件时返回(None, None)
+
+        优先取已经解码完成的预取项；都未完成时取队首，队列为空时立即提交解码。
+        """
+        with self.lock:
+            prefetched = self.pending.setdefault(pool, deque())
+            item = None
+            for i, (path, future) in enumerate(prefetched):
+                if not self.fifo and future.done():
+                    item = prefetched[i]
+                    del prefetched[i]
+                    self.ready_hits += 1
+                    break
+            if item is None and prefetched:
+                item = prefetched.popleft()
+                self.waits += 1
+        
+        if item is None:
+            path = self.library.pick(pool)
+            if path is None:
+                return None, None
+            with self.lock:
+                self.waits += 1
+            item = (path, self.executor.submit(self._load, path))
+        
+        self.fill(pool)
+        return item
+
+    def on_library_changed(self, library):
+        """音频索引变化时丢弃已失效的预取项"""
+        with self.lock:
+            for name in list(self.pending):
+                if name is not None and name not in library.pools:
+                    for path, future in self.pending.pop(name):
+                        future.cancel()
+                    continue
+                valid = set(library.files_for(name))
+                prefetched = self.pending[name]
+                for item in [item for item in prefetched if item[0] not in valid]:
+                    item[1].cancel()
+                    prefetched.remove(item)
+        self.fill()
+
+    def discard_source(self, path):
+        """丢弃某个源文件的预取项（裁剪/切分结果变化后调用）"""
+        with self.lock:
+            for prefetched in self.pending.values():
+                for item in [item for item in prefetched if clip_source(item[0]) == path]:
+                    item[1].cancel()
+                    prefetched.remove(item)
+
+    def reset(self):
+        """丢弃所有预取项（混音器格式变化后旧的Sound不能再用）"""
+        with self.lock:
+            for prefetched in self.pending.values():
+                for path, future in prefetched:
+                    future.cancel()
+            self.pending.clear()
+        self.fill()
+
+    def shutdown(self):
+        """停止线程池，取消尚未开始的解码任务"""
+        with self.lock:
+            self.closed = True
+            self.pending.clear()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+# ========== 混音器与延迟 ==========
+# 延迟档位：从低延迟到稳定依次排列，设备出问题时向后回退
+LATENCY_PROFILES = OrderedDict([
+    ("low", {"frequency": 48000, "buffer": 256}),
+    ("balanced", {"frequency": 44100, "buffer": 1024}),
+    ("safe", {"frequency": 44100, "buffer": 4096}),
+])
+UNDERRUN_LIMIT = 3  # 同一档位下检测到多少次播放超时就回退
+UNDERRUN_TOLERANCE = 0.25  # 超出音频时长多少秒算作播放超时
+DECODE_TIMEOUT_SECONDS = 10.0  # 播放时等待解码结果的最长时间
+
+class MixerGate:
+    """mixer重新初始化时的闸门
+
+    解码、变调和回收线程使用mixer时进入use()，可以同时有多个；切换延迟档位时exclusive()
+    挡住新的进入并等已经进入的退出，重新初始化完成后再放行。
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.users = 0
+        self.closed = False
+
+    @contextmanager
+    def use(self):
+        with self.cond:
+            while self.closed:
+                self.cond.wait()
+            self.users += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.users -= 1
+                if not self.users:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self.cond:
+            while self.closed:
+                self.cond.wait()
+            self.closed = True
+            while self.users:
+                self.cond.wait()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.closed = False
+                self.cond.notify_all()
+
+mixer_gate = MixerGate()
+
+def init_mixer(profile):
+    """按延迟档位初始化mixer，初始化失败时自动使用更稳定的档位，返回实际使用的档位"""
+    names = list(LATENCY_PROFILES)
+    if profile not in LATENCY_PROFILES:
+        print(f"未知的延迟档位: {profile}，使用 {DEFAULT_LATENCY_PROFILE}")
+        profile = DEFAULT_LATENCY_PROFILE
+    
+    last_error = None
+    for name in names[names.index(profile):]:
+        settings = LATENCY_PROFILES[name]
+        try:
+            mixer.init(frequency=settings["frequency"], size=-16, channels=2, buffer=settings["buffer"])
+            print(f"混音器初始化: {name} ({settings['frequency']}Hz, 缓冲 {settings['buffer']})")
+            return name
+        except Exception as e:
+            print(f"混音器初始化失败 ({name}): {e}")
+            last_error = e
+            mixer.quit()
+    raise last_error
+
+class LatencyMonitor:
+    """记录按键到channel.play的延迟，并根据播放超时判断是否需要回退延迟档位"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.samples = deque(maxlen=200)  # 最近的延迟（毫秒）
+        self.underruns = 0
+
+    def record(self, trigger_time, play_time):
+        """记录一次按键到播放的延迟，返回毫秒数"""
+        latency_ms = (play_time - trigger_time) * 1000
+        self.samples.append(latency_ms)
+        return latency_ms
+
+    def output_latency_ms(self):
+        """当前档位的输出缓冲延迟"""
+        settings = LATENCY_PROFILES[self.profile]
+        return settings["buffer"] / settings["frequency"] * 1000
+
+    def report_overrun(self):
+        """报告一次播放超时，达到阈值时返回应回退到的档位，否则返回None"""
+        self.underruns += 1
+        if self.underruns < UNDERRUN_LIMIT:
+            return None
+        names = list(LATENCY_PROFILES)
+        index = names.index(self.profile)
+        if index + 1 >= len(names):
+            return None
+        return names[index + 1]
+
+    def switch(self, profile):
+        self.profile = profile
+        self.underruns = 0
+        self.samples.clear()
+
+    def summary(self):
+        """返回延迟统计（毫秒）"""
+        samples = sorted(self.samples)
+        result = {
+            "profile": self.profile,
+            "output_ms": self.output_latency_ms(),
+            "count": len(samples),
+            "underruns": self.underruns,
+        }
+        if samples:
+            result["last_ms"] = self.samples[-1]
+            result["p50_ms"] = samples[len(samples) // 2]
+            result["p95_ms"] = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            result["max_ms"] = samples[-1]
+        return result
+
+# ========== 声部管理 ==========
+STEAL_POLICIES = ("oldest", "quietest", "none")
+CHANNEL_GROW_STEP = 8  # 通道不够时每次增加的数量
+REAP_INTERVAL = 0.05  # 回收线程检查通道的间隔（秒）
+MUSIC_VOICE = -1  # 交给mixer.music播放的声部使用的编号，不占用通道
+
+class MusicChannel:
+    """把mixer.music包装成Channel的接口，整体交给mixer.music播放的长文件也作为声部管理"""
+
+    def __init__(self, volume=1.0):
+        self.volume = volume  # 片段自身的音量（响度归一化）
+        self.scale = 1.0  # 限幅器设置的通道音量
+
+    def get_busy(self):
+        return mixer.music.get_busy()
+
+    def get_queue(self):
+        return None
+
+    def stop(self):
+        mixer.music.stop()
+
+    def set_volume(self, volume):
+        self.scale = volume
+        mixer.music.set_volume(self.volume * volume)
+
+    def get_volume(self):
+        return self.scale
+
+class Voice:
+    """一个正在播放的声部"""
+    __slots__ = ("index", "channel", "sound", "path", "started", "priority", "deadline", "stream")
+
+    def __init__(self, index, channel, sound, path, started, priority, stream=None):
+        self.index = index
+        self.channel = channel
+        self.sound = sound
+        self.path = path
+        self.started = started
+        self.priority = priority
+        # 超过这个时间还在播放视为输出欠载，只报告一次
+        self.deadline = started + sound.get_length() + UNDERRUN_TOLERANCE
+        self.stream = stream  # 流式播放时后续块的迭代器，由回收线程接续到通道队列
+
+    def feed(self):
+        """通道队列空出来时排入下一块，返回是否还有后续"""
+        if self.stream is None:
+            return False
+        if self.channel.get_queue() is not None:
+            return True
+        chunk = next(self.stream, None)
+        if chunk is None:
+            self.stream = None
+            return False
+        self.channel.queue(chunk)
+        if self.deadline is not None:
+            self.deadline += chunk.get_length()
+        return True
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def loudness(self):
+        return self.channel.get_volume() * self.sound.get_volume()
+
+class VoiceManager:
+    """分配mixer通道：通道用完时按需扩容，到达上限后按策略抢占已有声部"""
+
+    def __init__(self, num_channels=DEFAULT_MIXER_CHANNELS, max_channels=DEFAULT_MAX_CHANNELS,
+                 policy=DEFAULT_STEAL_POLICY, max_per_file=DEFAULT_MAX_INSTANCES_PER_FILE, backend=None):
+        # 提供set_num_channels/Channel/stop的混音后端，None表示pygame.mixer，也可以是SoftwareMixer
+        self.backend = backend
+        if policy not in STEAL_POLICIES:
+            print(f"未知的抢占策略: {policy}，使用 {DEFAULT_STEAL_POLICY}")
+            policy = DEFAULT_STEAL_POLICY
+        self.policy = policy
+        self.max_per_file = max_per_file
+        self.max_channels = max(num_channels, max_channels)
+        self.limiter = False  # 按同时播放的声部数降低每个通道的音量，防止叠加后削波
+        self.voice_limit = None  # 同时播放的声部数上限（资源调节时设置），None表示只受通道数限制
+        self.lock = threading.RLock()
+        self.wakeup = threading.Condition(self.lock)
+        self.on_change = None  # 回调(声部数量, 超时声部列表)，在回收线程中调用
+        self.steals = 0
+        self.grows = 0
+        self.drops = 0
+        self._reaper = None
+        self._stopped = False
+        self.reset(num_channels)
+
+    def reset(self, num_channels):
+        """（重新）设置通道数量并清空所有声部，mixer重新初始化后调用"""
+        with self.lock:
+            (self.backend or mixer).set_num_channels(num_channels)
+            self.num_channels = num_channels
+            self.voices = {}  # 通道编号 -> Voice
+            self.by_path = {}  # 文件路径 -> 正在播放它的Voice集合
+            self.free = deque(range(num_channels))
+
+    def active_count(self):
+        return len(self.voices)
+
+    def is_active(self, voice):
+        """声部是否仍占用着它的通道（没有被释放或抢占）"""
+        return self.voices.get(voice.index) is voice
+
+    def release(self, voice):
+        """释放声部，把通道放回空闲队列"""
+        with self.lock:
+            if self.voices.get(voice.index) is not voice:
+                return False
+            del self.voices[voice.index]
+            voice.close()
+            same_file = self.by_path.get(voice.path)
+            if same_file is not None:
+                same_file.discard(voice)
+                if not same_file:
+                    del self.by_path[voice.path]
+            if voice.index != MUSIC_VOICE:
+                self.free.append(voice.index)
+            return True
+
+    def reap(self):
+        """释放所有已播放完的声部，返回(释放数量, 新发现的超时声部列表)"""
+        now = time.perf_counter()
+        finished = 0
+        overdue = []
+        with self.lock:
+            for voice in list(self.voices.values()):
+                if not voice.channel.get_busy():
+                    self.release(voice)
+                    finished += 1
+                    continue
+                voice.feed()
+                if voice.deadline is not None and now > voice.deadline:
+                    voice.deadline = None
+                    overdue.append(voice)
+            if finished:
+                self._apply_limiter()
+        return finished, overdue
+
+    def _apply_limiter(self):
+        """按声部数量调整所有通道音量：n个声部各自乘以1/sqrt(n)"""
+        if not self.limiter:
+            return
+        scale = 1.0 / max(1, len(self.voices)) ** 0.5
+        for voice in self.voices.values():
+            voice.channel.set_volume(scale)
+
+    def _reap_loop(self):
+        """单个回收线程轮询所有通道，没有声部时休眠等待"""
+        while True:
+            with self.wakeup:
+                while not self.voices and not self._stopped:
+                    self.wakeup.wait()
+                if self._stopped:
+                    return
+            time.sleep(REAP_INTERVAL)
+            try:
+                with mixer_gate.use():
+                    finished, overdue = self.reap()
+            except Exception as e:
+                # 出错时回收线程继续运行，否则通道再也不会被释放
+                print(f"声部回收失败: {e}")
+                continue
+            if (finished or overdue) and self.on_change:
+                try:
+                    self.on_change(self.active_count(), overdue)
+                except Exception as e:
+                    print(f"声部回调错误: {e}")
+
+    def start_reaper(self):
+        """启动回收线程"""
+        if self._reaper is None:
+            self._stopped = False
+            self._reaper = threading.Thread(target=self._reap_loop, daemon=True)
+            self._reaper.start()
+
+    def stop_reaper(self):
+        """停止回收线程"""
+        with self.wakeup:
+            self._stopped = True
+            self.wakeup.notify_all()
+        if self._reaper is not None:
+            self._reaper.join(timeout=1)
+            self._reaper = None
+
+    def _reclaim_finished(self):
+        """回收已经播放完但还没释放的声部"""
+        for voice in [v for v in self.voices.values() if not v.channel.get_busy()]:
+            self.release(voice)
+
+    def _grow(self):
+        new_count = min(self.max_channels, self.num_channels + CHANNEL_GROW_STEP)
+        if new_count <= self.num_channels:
+            return False
+        (self.backend or mixer).set_num_channels(new_count)
+        self.free.extend(range(self.num_channels, new_count))
+        self.num_channels = new_count
+        self.grows += 1
+        return True
+
+    def _at_limit(self):
+        return self.voice_limit is not None and len(self.voices) >= self.voice_limit
+
+    def _choose_victim(self, candidates, priority):
+        candidates = [v for v in candidates if v.priority <= priority]
+        if not candidates:
+            return None
+        if self.policy == "quietest":
+            return min(candidates, key=lambda v: (v.loudness(), v.started))
+        return min(candidates, key=lambda v: v.started)
+
+    def _steal(self, victim):
+        victim.channel.stop()
+        self.release(victim)
+        self.steals += 1
+
+    def play(self, path, sound, priority=0, stream=None):
+        """在一个通道上播放声音，返回Voice；无法分配通道时返回None
+
+        stream为流式播放时后续块的迭代器，sound是第一块。
+        """
+        with self.lock:
+            # 单个文件同时播放的实例数限制：抢占该文件最早的实例
+            same_file = self.by_path.get(path)
+            if self.max_per_file > 0 and same_file and len(same_file) >= self.max_per_file:
+                victim = self._choose_victim(same_file, priority)
+                if victim is None:
+                    self.drops += 1
+                    if stream is not None:
+                        stream.close()
+                    return None
+                self._steal(victim)
+            
+            if not self.free or self._at_limit():
+                self._reclaim_finished()
+            if not self.free and not self._at_limit():
+                self._grow()
+            if not self.free or self._at_limit():
+                victim = None
+                if self.policy != "none":
+                    victim = self._choose_victim(self.voices.values(), priority)
+                if victim is None:
+                    self.drops += 1
+                    if stream is not None:
+                        stream.close()
+                    return None
+                self._steal(victim)
+            
+            index = self.free.popleft()
+            channel = (self.backend or mixer).Channel(index)
+            if self.limiter:
+                channel.set_volume(1.0 / (len(self.voices) + 1) ** 0.5)
+            else:
+                channel.set_volume(1.0)
+            channel.play(sound)
+            voice = Voice(index, channel, sound, path, time.perf_counter(), priority, stream)
+            voice.feed()
+            self.voices[index] = voice
+            self.by_path.setdefault(path, set()).add(voice)
+            self._apply_limiter()
+            self.wakeup.notify()
+            return voice
+
+    def play_music(self, path, stream, priority=0):
+        """把没有分块数据的长片段交给mixer.music播放，返回Voice；mixer.music正在使用或无法分配时返回None
+
+        和通道上的声部一样计入声部数、限幅和声部上限。
+        """
+        with self.lock:
+            music = self.voices.get(MUSIC_VOICE)
+            if music is not None and not music.channel.get_busy():
+                self.release(music)
+                music = None
+            if music is not None or mixer.music.get_busy():
+                # mixer.music只有一路
+                self.drops += 1
+                return None
+            if self._at_limit():
+                self._reclaim_finished()
+            if self._at_limit():
+                victim = None
+                if self.policy != "none":
+                    victim = self._choose_victim(self.voices.values(), priority)
+                if victim is None:
+                    self.drops += 1
+                    return None
+                self._steal(victim)
+            
+            channel = MusicChannel(stream.volume)
+            channel.set_volume(1.0 / (len(self.voices) + 1) ** 0.5 if self.limiter else 1.0)
+            mixer.music.load(stream.path)
+            mixer.music.play(start=stream.start)
+            voice = Voice(MUSIC_VOICE, channel, stream, path, time.perf_counter(), priority)
+            # mixer.music自己解码，不按片段时长判断欠载
+            voice.deadline = None
+            self.voices[MUSIC_VOICE] = voice
+            self.by_path.setdefault(path, set()).add(voice)
+            self._apply_limiter()
+            self.wakeup.notify()
+            return voice
+
+    def stop_all(self):
+        """停止所有声部"""
+        with self.lock:
+            (self.backend or mixer).stop()
+            # 没有分块数据、交给mixer.music播放的长文件
+            mixer.music.stop()
+            for voice in self.voices.values():
+                voice.close()
+            self.voices.clear()
+            self.by_path.clear()
+            self.free = deque(range(self.num_channels))
+        if self.on_change:
+            self.on_change(0, [])
+
+    def stats(self):
+        """返回声部统计信息"""
+        with self.lock:
+            sounds = {id(voice.sound): voice.sound for voice in self.voices.values()
+                      if not isinstance(voice.sound, StreamSource)}
+        return {
+            "active": len(self.voices),
+            "playing_bytes": sum(sound_nbytes(sound) for sound in sounds.values()),
+            "channels": self.num_channels,
+            "max_channels": self.max_channels,
+            "voice_limit": self.voice_limit,
+            "policy": self.policy,
+            "limiter": self.limiter,
+            "steals": self.steals,
+            "grows": self.grows,
+            "drops": self.drops,
+        }
+
+# ========== 软件混音 ==========
+DEFAULT_SOFTWARE_BLOCK_FRAMES = 1024
+
+class SoftChannel:
+    """软件混音器的一个通道，接口和mixer.Channel相同：play/stop/queue/get_queue/get_busy/音量"""
+
+    def __init__(self, owner, index):
+        self.owner = owner
+        self.index = index
+        self.sound = None
+        self.data = None  # float32数组，形状(帧数, 声道数)
+        self.pos = 0
+        self.queued = None
+        self.volume = 1.0
+
+    def _start(self, sound):
+        self.sound = sound
+        self.data = self.owner.samples(sound)
+        self.pos = 0
+
+    def play(self, sound):
+        with self.owner.lock:
+            self._start(sound)
+            self.queued = None
+
+    def queue(self, sound):
+        with self.owner.lock:
+            if self.sound is None:
+                self._start(sound)
+            else:
+                self.queued = sound
+
+    def get_queue(self):
+        return self.queued
+
+    def get_sound(self):
+        return self.sound
+
+    def stop(self):
+        with self.owner.lock:
+            self.sound = self.data = self.queued = None
+
+    def get_busy(self):
+        return self.sound is not None
+
+    def set_volume(self, volume):
+        self.volume = volume
+
+    def get_volume(self):
+        return self.volume
+
+class SoftwareMixer:
+    """用NumPy按块把所有活动通道叠加起来的混音器
+
+    通道接口和pygame.mixer一致（set_num_channels/Channel/stop），可以直接作为VoiceManager的后端，
+    没有声卡时也能测试叠加、削波和声部上限；混出的块交给WavOutput写文件或PygameStreamOutput播放。
+    """
+
+    def __init__(self, frequency, channels=2, num_channels=DEFAULT_MIXER_CHANNELS):
+        self.frequency = frequency
+        self.channels = channels
+        self.lock = threading.RLock()
+        self.channel_list = []
+        self.frames = 0  # 已混音的总帧数
+        self.peak = 0.0  # 叠加后（削波前）的最大幅度
+        self.clipped = 0  # 被削波的采样数
+        self.set_num_channels(num_channels)
+
+    def get_init(self):
+        return self.frequency, -16, self.channels
 
-def load_config():
-    """加载配置文件"""
-    config_path = os.path.join(get_base_path(), CONFIG_FILE)
-    if os.path.exists(config_path):
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {"hotkey": DEFAULT_HOTKEY, "hotkey_display": DEFAULT_HOTKEY}
-    return {"hotkey": DEFAULT_HOTKEY, "hotkey_display": DEFAULT_HOTKEY}
+    def set_num_channels(self, count):
+        with self.lock:
+            for channel in self.channel_list[count:]:
+                channel.stop()
+            del self.channel_list[count:]
+            self.channel_list.extend(SoftChannel(self, i) for i in range(len(self.channel_list), count))
 
-def save_config(config):
-    """保存配置文件"""
-    config_path = os.path.join(get_base_path(), CONFIG_FILE)
-    try:
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+    def get_num_channels(self):
+        return len(self.channel_list)
+
+    def Channel(self, index):
+        return self.channel_list[index]
+
+    def stop(self):
+        with self.lock:
+            for channel in self.channel_list:
+                channel.stop()
+
+    def active_count(self):
+        return sum(1 for channel in self.channel_list if channel.sound is not None)
+
+    def samples(self, sound):
+        """Sound -> float32数组(帧数, 声道数)，范围[-1, 1]"""
+        import numpy as np
+        data = sound_samples(sound)
+        if data.shape[1] != self.channels:
+            data = np.repeat(data[:, :1], self.channels, axis=1)
+        return data
+
+    def mix(self, frames):
+        """混出下一块，返回int16数组(帧数, 声道数)"""
+        import numpy as np
+        out = np.zeros((frames, self.channels), dtype=np.float32)
+        with self.lock:
+            for channel in self.channel_list:
+                written = 0
+                while written < frames and channel.sound is not None:
+                    count = min(frames - written, len(channel.data) - channel.pos)
+                    gain = channel.volume * channel.sound.get_volume()
+                    out[written:written + count] += channel.data[channel.pos:channel.pos + count] * gain
+                    channel.pos += count
+                    written += count
+                    if channel.pos >= len(channel.data):
+                        if channel.queued is not None:
+                            queued, channel.queued = channel.queued, None
+                            channel._start(queued)
+                        else:
+                            channel.stop()
+            self.frames += frames
+        if frames:
+            magnitude = np.abs(out)
+            self.peak = max(self.peak, float(magnitude.max()))
+            self.clipped += int(np.count_nonzero(magnitude > 1.0))
+        return (np.clip(out, -1.0, 1.0) * 32767).astype('<i2')
+
+    def stats(self):
+        return {
+            "seconds": round(self.frames / self.frequency, 3),
+            "peak_db": round(power_to_db(self.peak ** 2), 2),
+            "clipped_samples": self.clipped,
+        }
+
+class WavOutput:
+    """把混音结果写入16位WAV文件"""
+
+    def __init__(self, path, frequency, channels=2):
+        self.file = wave.open(path, 'wb')
+        self.file.setnchannels(channels)
+        self.file.setsampwidth(2)
+        self.file.setframerate(frequency)
+
+    def write(self, block):
+        self.file.writeframes(block.tobytes())
+
+    def close(self):
+        self.file.close()
+
+class PygameStreamOutput:
+    """把软件混音器的输出按块排入一个pygame通道实时播放（这个通道不交给VoiceManager）"""
+
+    def __init__(self, soft_mixer, block_frames=DEFAULT_SOFTWARE_BLOCK_FRAMES, channel_index=0):
+        self.soft_mixer = soft_mixer
+        self.block_frames = block_frames
+        self.channel_index = channel_index
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        block_seconds = self.block_frames / self.soft_mixer.frequency
+        while not self._stop_event.is_set():
+            try:
+                channel = mixer.Channel(self.channel_index)
+                if channel.get_queue() is None:
+                    block = mixer.Sound(buffer=self.soft_mixer.mix(self.block_frames).tobytes())
+                    if channel.get_busy():
+                        channel.queue(block)
+                    else:
+                        channel.play(block)
+            except Exception as e:
+                print(f"软件混音输出错误: {e}")
+            self._stop_event.wait(block_seconds / 4)
+
+    def start(self):
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="soft-mixer-output", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+# ========== 触发队列 ==========
+class TriggerQueue:
+    """触发队列：键盘监听线程只负责入队，由单独的消费线程开始播放
+
+    入队前做防抖（同一声音池两次触发的最小间隔）和令牌桶限速（每秒最多触发次数，
+    允许短时间突发）。混音器相关的其它操作也通过call()放到同一个线程里串行执行。
+    """
+
+    def __init__(self, handler, debounce_ms=DEFAULT_TRIGGER_DEBOUNCE_MS,
+                 max_per_second=DEFAULT_MAX_TRIGGERS_PER_SECOND, burst=DEFAULT_TRIGGER_BURST):
+        self.handler = handler  # 播放函数(触发时间, 声音池)
+        self.debounce = debounce_ms / 1000
+        self.rate = max_per_second
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last_refill = time.perf_counter()
+        self.last_accepted = {}  # 声音池 -> 上次接受触发的时间
+        self.accepted = 0
+        self.suppressed_debounce = 0
+        self.suppressed_rate = 0
+        self.lock = threading.Lock()
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+
+    def submit(self, pool=None, trigger_time=None):
+        """提交一次触发，被防抖或限速过滤时返回False"""
+        now = time.perf_counter()
+        if trigger_time is None:
+            trigger_time = now
+        with self.lock:
+            last = self.last_accepted.get(pool)
+            if last is not None and now - last < self.debounce:
+                self.suppressed_debounce += 1
+                return False
+            
+            if self.rate > 0:
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens < 1:
+                    self.suppressed_rate += 1
+                    return False
+                self.tokens -= 1
+            
+            self.last_accepted[pool] = now
+            self.accepted += 1
+        self.queue.put((self.handler, (trigger_time, pool)))
         return True
-    except:
-        return False
 
-# ========== 路径处理 ==========
-def get_base_path():
-    """获取程序的基准路径（支持源码和打包后）"""
-    if getattr(sys, 'frozen', False):
-        # 打包后的EXE
-        base_path = os.path.dirname(sys.executable)
-    else:
-        # 源码运行
-        base_path = os.path.dirname(os.path.abspath(__file__))
-    
-    print(f"DEBUG: 程序路径: {base_path}")
-    return base_path
+    def configure(self, debounce_ms, max_per_second, burst):
+        """修改防抖和限速参数（配置文件热更新时调用）"""
+        with self.lock:
+            self.debounce = debounce_ms / 1000
+            self.rate = max_per_second
+            self.burst = max(1, burst)
+            self.tokens = min(self.tokens, float(self.burst))
 
-def get_audio_files():
-    """获取所有音频文件路径"""
-    base_dir = get_base_path()
-    audio_files = []
+    def call(self, func, *args):
+        """在消费线程中执行函数（不受限速影响）"""
+        self.queue.put((func, args))
+
+    def _consume(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            func, args = item
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"触发处理错误: {e}")
+
+    def start(self):
+        """启动消费线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._consume, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止消费线程，已入队的触发执行完后退出"""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def stats(self):
+        """返回触发统计信息"""
+        with self.lock:
+            return {
+                "accepted": self.accepted,
+                "suppressed": self.suppressed_debounce + self.suppressed_rate,
+                "suppressed_debounce": self.suppressed_debounce,
+                "suppressed_rate": self.suppressed_rate,
+            }
+
+# ========== 触发记录 ==========
+class TraceRecorder:
+    """把快捷键触发逐行记录为"秒数 [声音池]"，格式和--render的触发脚本相同，可以直接渲染或用回放测试.py回放
+
+    每次启动重新开始记录，时间从打开文件时算起。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.perf_counter()
+        self.count = 0
+        self.lock = threading.Lock()
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write(f"# 触发记录 {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        self.file.flush()
+
+    def record(self, pool, trigger_time):
+        line = f"{trigger_time - self.start:.4f}" + (f" {pool}" if pool else "")
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line + "\n")
+            # 按键频率很低，每行都刷到磁盘，程序崩溃时也不会丢失记录
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+# ========== 运行统计 ==========
+DEFAULT_STATS_INTERVAL_SECONDS = 10.0
+TIMING_STAGES = ("queue", "decode", "play", "total")
+
+def summarize_ms(samples):
+    """p50/p95/max（毫秒）"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+class TriggerStats:
+    """记录每次触发各阶段的耗时：按键 -> 消费线程取出(queue) -> 解码完成(decode) -> channel.play(play)"""
+
+    def __init__(self, size=500):
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=size)  # 每项为 (queue, decode, play, total)，单位毫秒
+        self.played = 0
+        self.no_voice = 0  # 没有可用通道而丢弃
+        self.failed = 0  # 解码或播放出错
+        self.missing = 0  # 没有可播放的文件
+
+    def record(self, trigger_time, dispatch_time, ready_time, play_time):
+        timing = ((dispatch_time - trigger_time) * 1000,
+                  (ready_time - dispatch_time) * 1000,
+                  (play_time - ready_time) * 1000,
+                  (play_time - trigger_time) * 1000)
+        with self.lock:
+            self.recent.append(timing)
+            self.played += 1
+        return timing
+
+    def count(self, name):
+        """没有播放成功的触发按原因计数：no_voice、failed或missing"""
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def summary(self):
+        """返回各阶段的延迟统计和计数"""
+        with self.lock:
+            recent = list(self.recent)
+            result = {"played": self.played, "no_voice": self.no_voice,
+                      "failed": self.failed, "missing": self.missing}
+        for i, stage in enumerate(TIMING_STAGES):
+            result[stage] = summarize_ms([timing[i] for timing in recent])
+        return result
+
+def process_rss_bytes():
+    """当前进程的常驻内存（字节），取不到时返回None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+        
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in (
+                           "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                           "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                           "PagefileUsage", "PeakPagefileUsage")]
+        
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+        if get_info(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+class StatsExporter:
+    """定期把运行统计以JSON Lines追加到日志文件，供离线分析"""
+
+    def __init__(self, path, interval, collect):
+        self.path = path
+        self.interval = max(1.0, interval)
+        self.collect = collect  # 返回统计字典的函数
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        """立即写入一行"""
+        line = json.dumps({"time": round(time.time(), 3), **self.collect()}, ensure_ascii=False)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                print(f"写入统计日志失败: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止导出线程，退出前再写一行"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=2)
+            self._thread = None
+            try:
+                self.write()
+            except Exception as e:
+                print(f"写入统计日志失败: {e}")
+
+# ========== 资源调节 ==========
+# 逐级加强的调节手段，每一级包含前面所有级别的手段
+GOVERNOR_LEVELS = ("正常", "缩小缓存", "优先短片段", "降低复音数")
+GOVERNOR_CACHE_SCALE = 0.5  # 缩小缓存时的预算比例
+
+class ResourceGovernor:
+    """定期检查内存和通道负载，紧张时逐级加强调节，恢复后逐级撤销
+
+    measure返回{"rss_bytes", "decoded_bytes", "channel_load"}，apply(级别)执行对应级别的调节。
+    每次检查最多升降一级；升级只要任一指标超过阈值，降级要求所有指标连续calm_checks次低于
+    阈值乘以release_ratio，避免在阈值附近来回切换。
+    """
+
+    def __init__(self, measure, apply, rss_bytes=0, decoded_bytes=0, channel_load=0.0,
+                 release_ratio=DEFAULT_GOVERNOR_RELEASE_RATIO, calm_checks=DEFAULT_GOVERNOR_CALM_CHECKS,
+                 interval=DEFAULT_GOVERNOR_INTERVAL_SECONDS):
+        self.measure = measure
+        self.apply = apply
+        self.limits = {"rss_bytes": rss_bytes, "decoded_bytes": decoded_bytes, "channel_load": channel_load}
+        self.release_ratio = release_ratio
+        self.calm_checks = max(1, calm_checks)
+        self.interval = interval
+        self.level = 0
+        self.calm = 0
+        self.adaptations = 0
+        self.last = {}  # 最近一次检查的指标
+        self.events = deque(maxlen=20)  # 最近的级别变化
+        self._stop = threading.Event()
+        self._thread = None
+
+    def over(self, sample, ratio=1.0):
+        """超过阈值（乘以ratio）的指标名称列表；阈值为0或取不到数值的指标不检查"""
+        return [name for name, limit in self.limits.items()
+                if limit and sample.get(name) is not None and sample[name] > limit * ratio]
+
+    def check(self):
+        """检查一次，必要时升降一级，返回当前级别"""
+        sample = self.measure()
+        reasons = self.over(sample)
+        level = self.level
+        if reasons:
+            self.calm = 0
+            level = min(level + 1, len(GOVERNOR_LEVELS) - 1)
+        elif self.level and not self.over(sample, self.release_ratio):
+            self.calm += 1
+            if self.calm >= self.calm_checks:
+                self.calm = 0
+                level -= 1
+        else:
+            self.calm = 0
+        self.last = sample
+        if level != self.level:
+            self.level = level
+            self.adaptations += 1
+            self.events.append({"time": round(time.time(), 3), "level": level,
+                                "action": GOVERNOR_LEVELS[level], "reasons": reasons})
+            self.apply(level)
+        return level
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"资源调节失败: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def configure(self, rss_bytes, decoded_bytes, channel_load, release_ratio, calm_checks):
+        """修改阈值（配置文件热更新时调用），当前级别保持不变"""
+        self.limits = {"rss_bytes": rss_bytes, "decoded_bytes": decoded_bytes, "channel_load": channel_load}
+        self.release_ratio = release_ratio
+        self.calm_checks = max(1, calm_checks)
+
+    def stop(self):
+        """停止检查线程"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def stats(self):
+        return {
+            "level": self.level,
+            "action": GOVERNOR_LEVELS[self.level],
+            "adaptations": self.adaptations,
+            "last": self.last,
+            "events": list(self.events)[-5:],
+        }
+
+# ========== 全局状态 ==========
+root = None  # GUI模式下的Tk窗口，无界面模式下为None
+library_job_lock = threading.Lock()
+pending_analysis = set()
+key_recording = False
+recorded_keys = []
+shutdown_event = threading.Event()
+ui_queue = queue.SimpleQueue()  # 后台线程交给Tk主线程执行的界面更新
+UI_POLL_MS = 50  # 主线程处理界面更新队列的间隔（毫秒）
+last_status = None
+engine_ready = threading.Event()  # 音频引擎在后台加载完成后置位
+engine_thread = None
+audio_library = None
+stats_exporter = None
+config_watcher = None
+trace_recorder = None
+governor = None
+short_clips_weight = False  # 资源调节是否正在压低长片段的权重
+saved_weight_func = None  # 压低前的权重函数
+soft_mixer = None  # 开启software_mixer时的软件混音器
+software_output = None
+
+# ========== 初始化 ==========
+ENGINE_JOIN_TIMEOUT = 5.0  # 关闭时等待音频加载线程的最长时间（秒）
+
+def init_config():
+    """读取配置并创建触发队列；窗口和快捷键只依赖这一步，可以在音频加载前就出现"""
+    global base_dir, config, current_hotkey, current_hotkey_display, trigger_queue, trigger_stats
     
-    for file in os.listdir(base_dir):
-        if file.lower().endswith(('.mp3', '.wav', '.ogg', '.flac')):
-            audio_files.append(os.path.join(base_dir, file))
+    base_dir = get_base_path()
+    os.chdir(base_dir)
     
-    if not audio_files:
-        for root, dirs, files in os.walk(base_dir):
-            for file in files:
-                if file.lower().endswith(('.mp3', '.wav', '.ogg', '.flac')):
-                    audio_files.append(os.path.join(root, file))
+    # 加载配置
+    config = load_config()
+    current_hotkey = config.get("hotkey", DEFAULT_HOTKEY)
+    current_hotkey_display = config.get("hotkey_display", DEFAULT_HOTKEY)
     
-    return audio_files
+    # 触发队列（音频就绪前的触发先排队，就绪后再播放）
+    trigger_queue = TriggerQueue(play_random_audio,
+                                 debounce_ms=config.get("trigger_debounce_ms", DEFAULT_TRIGGER_DEBOUNCE_MS),
+                                 max_per_second=config.get("max_triggers_per_second", DEFAULT_MAX_TRIGGERS_PER_SECOND),
+                                 burst=config.get("trigger_burst", DEFAULT_TRIGGER_BURST))
+    trigger_stats = TriggerStats()
 
-# ========== 初始化 ==========
-base_dir = get_base_path()
-os.chdir(base_dir)
+def init_audio(offline=False):
+    """初始化音频引擎：混音器、音频索引、缓存和解码线程池（在后台线程中执行）
+
+    offline为True时用于离线渲染：不监视目录变化，预取按选择顺序取出，变调版本在调用线程中生成，
+    随机选择只在调用线程中进行，同样的种子得到同样的结果。
+    """
+    global latency_profile, latency_monitor, voice_manager, audio_library, soft_mixer, software_output
+    global normalize_enabled, normalize_target_db, pcm_cache, trim_options
+    global sample_bank, source_loader, clip_loader, sound_cache, variant_cache, decode_pool
+    
+    with startup_profiler.phase("导入pygame"):
+        import_mixer()
+    
+    # 初始化pygame mixer
+    with startup_profiler.phase("初始化混音器"):
+        latency_profile = init_mixer(config.get("latency_profile", DEFAULT_LATENCY_PROFILE))
+        latency_monitor = LatencyMonitor(latency_profile)
+        
+        # 软件混音（可选）：声部在NumPy里叠加，结果排入一个pygame通道播放
+        soft_mixer = software_output = None
+        if config.get("software_mixer", False):
+            frequency, _, channels = mixer.get_init()
+            soft_mixer = SoftwareMixer(frequency, channels)
+            software_output = PygameStreamOutput(soft_mixer, config.get("software_block_frames",
+                                                                         DEFAULT_SOFTWARE_BLOCK_FRAMES))
+        
+        # 声部管理
+        voice_manager = VoiceManager(num_channels=config.get("mixer_channels", DEFAULT_MIXER_CHANNELS),
+                                     max_channels=config.get("max_channels", DEFAULT_MAX_CHANNELS),
+                                     policy=config.get("steal_policy", DEFAULT_STEAL_POLICY),
+                                     max_per_file=config.get("max_instances_per_file", DEFAULT_MAX_INSTANCES_PER_FILE),
+                                     backend=soft_mixer)
+        voice_manager.limiter = config.get("limiter", DEFAULT_LIMITER) == "voices"
+    
+    # 音频索引
+    with startup_profiler.phase("扫描音频"):
+        # 静音裁剪与切分：只有参数签名一致的切分结果才会展开成片段
+        trim_options = trim_options_from_config(config)
+        library = AudioLibrary(base_dir, config.get("library_poll_seconds", DEFAULT_LIBRARY_POLL_SECONDS),
+                               selector=ClipSelector(config.get("no_repeat_window", DEFAULT_NO_REPEAT_WINDOW)))
+        library.weight_func = make_weight_func(library,
+                                               config.get("weight_mode", DEFAULT_WEIGHT_MODE),
+                                               config.get("clip_weights", {}))
+        library.load_metadata(os.path.join(base_dir, ANALYSIS_FILE))
+        library.trim = trim_options.signature()
+        if config.get("dedupe", True):
+            library.dedupe = (config.get("dedupe_threshold", DEFAULT_DEDUPE_THRESHOLD),
+                              config.get("dedupe_length_tolerance", DEFAULT_DEDUPE_LENGTH_TOLERANCE))
+        library.scan()
+        if not offline:
+            library.start_watching()
+    
+    with startup_profiler.phase("创建缓存"):
+        # 响度归一化
+        normalize_enabled = config.get("normalize", True)
+        normalize_target_db = config.get("normalize_target_db", DEFAULT_NORMALIZE_TARGET_DB)
+        
+        # 磁盘PCM缓存（可选）
+        pcm_cache = None
+        if config.get("pcm_cache", False):
+            pcm_cache = PcmDiskCache(os.path.join(base_dir, PCM_CACHE_DIR))
+        
+        source_loader = pcm_cache.load if pcm_cache else mixer.Sound
+        
+        # 构建时打包的采样库：整个库一次内存映射，分析结果直接可用
+        sample_bank = None
+        if config.get("sample_bank", DEFAULT_SAMPLE_BANK):
+            sample_bank = open_sample_bank(os.path.join(base_dir, config.get("sample_bank", DEFAULT_SAMPLE_BANK)),
+                                           base_dir, fallback=source_loader)
+        if sample_bank:
+            sample_bank.seed_metadata(library)
+            source_loader = sample_bank.load
+        clip_loader = ClipLoader(library, source_loader, pcm_cache, sample_bank)
+        
+        # 已解码音频缓存
+        sound_cache = SoundCache(int(config.get("sound_cache_mb", DEFAULT_SOUND_CACHE_MB) * 1024 * 1024),
+                                 loader=clip_loader)
+        
+        # 变调变速版本
+        variant_cache = VariantCache(int(config.get("variant_cache_mb", DEFAULT_VARIANT_CACHE_MB) * 1024 * 1024),
+                                     semitones=config.get("pitch_variation_semitones", DEFAULT_PITCH_VARIATION_SEMITONES),
+                                     count=config.get("pitch_variants", DEFAULT_PITCH_VARIANTS))
+        variant_cache.inline = offline
+    
+    # 后台解码与预取
+    with startup_profiler.phase("预取解码"):
+        decode_pool = DecodePool(library, sound_cache,
+                                 depth=config.get("prefetch_depth", DEFAULT_PREFETCH_DEPTH),
+                                 workers=config.get("decode_workers", DEFAULT_DECODE_WORKERS))
+        library.listeners.append(decode_pool.on_library_changed)
+        decode_pool.variants = None if offline else variant_cache
+        decode_pool.fifo = offline
+        if config.get("stream_long_files", True):
+            decode_pool.stream_planner = StreamPlanner(library, pcm_cache,
+                                                       min_seconds=config.get("stream_min_seconds", DEFAULT_STREAM_MIN_SECONDS),
+                                                       min_mb=config.get("stream_min_mb", DEFAULT_STREAM_MIN_MB),
+                                                       chunk_seconds=config.get("stream_chunk_seconds", DEFAULT_STREAM_CHUNK_SECONDS),
+                                                       sample_bank=sample_bank)
+        audio_library = library
+        # 快捷键先于音频索引设置，这里补上声音池
+        apply_pools(list(hotkey_dispatcher.table.values()))
+        decode_pool.fill()
 
-# 加载配置
-config = load_config()
-current_hotkey = config.get("hotkey", DEFAULT_HOTKEY)
-current_hotkey_display = config.get("hotkey_display", DEFAULT_HOTKEY)
+def start_audio():
+    """启动后台任务、声部回收线程和触发队列消费线程"""
+    # 后台生成PCM缓存、分析响度、裁剪静音
+    if pcm_cache or normalize_enabled or trim_options.enabled or audio_library.dedupe:
+        process_library()
+        audio_library.listeners.append(on_library_changed_jobs)
+    
+    # 启动声部回收线程
+    voice_manager.on_change = on_voices_changed
+    voice_manager.start_reaper()
+    if software_output:
+        software_output.start()
+    
+    # 启动触发队列，开始播放排队中的触发
+    trigger_queue.start()
+    
+    # 内存或通道紧张时自动调节
+    if config.get("governor", True):
+        global governor
+        governor = ResourceGovernor(
+            measure_resources, apply_governor_level,
+            rss_bytes=int(config.get("governor_rss_mb", DEFAULT_GOVERNOR_RSS_MB) * 1024 * 1024),
+            decoded_bytes=governor_decoded_limit(),
+            channel_load=config.get("governor_channel_load", DEFAULT_GOVERNOR_CHANNEL_LOAD),
+            release_ratio=config.get("governor_release_ratio", DEFAULT_GOVERNOR_RELEASE_RATIO),
+            calm_checks=config.get("governor_calm_checks", DEFAULT_GOVERNOR_CALM_CHECKS),
+            interval=config.get("governor_interval_seconds", DEFAULT_GOVERNOR_INTERVAL_SECONDS))
+        governor.start()
+    
+    # 定期导出运行统计
+    stats_log = config.get("stats_log")
+    if stats_log:
+        global stats_exporter
+        stats_exporter = StatsExporter(os.path.join(base_dir, stats_log),
+                                       config.get("stats_interval_seconds", DEFAULT_STATS_INTERVAL_SECONDS),
+                                       collect_stats)
+        stats_exporter.start()
 
-# 初始化pygame mixer
-mixer.init(frequency=44100, size=-16, channels=2, buffer=4096)
-mixer.set_num_channels(32)
+def load_engine(on_ready=None):
+    """后台加载音频引擎，完成后回调on_ready（在加载线程中调用）"""
+    global config_watcher
+    try:
+        init_audio()
+        if shutdown_event.is_set():
+            # 加载期间窗口已经关闭，不再启动后台任务，也不再更新界面
+            return
+        start_audio()
+    except Exception as e:
+        print(f"音频引擎初始化失败: {e}")
+        set_status(f"音频初始化失败: {e}")
+        return
+    if shutdown_event.is_set():
+        return
+    
+    engine_ready.set()
+    
+    # 监视配置文件，外部修改后立即生效
+    config_watcher = ConfigWatcher(config_path(), apply_config)
+    config_watcher.start()
+    set_status(f"就绪 - 点击按钮或按{current_hotkey_display}播放")
+    if on_ready:
+        on_ready()
+    startup_profiler.mark("音频就绪")
+    if startup_profiler.enabled:
+        print(startup_profiler.report())
 
-# 存储当前正在播放的声音对象
-active_sounds = []
+def start_engine(on_ready=None):
+    """先设置全局快捷键，再在后台线程中加载音频"""
+    global engine_thread, trace_recorder
+    trace = config.get("trigger_trace", DEFAULT_TRIGGER_TRACE)
+    if trace:
+        try:
+            trace_recorder = TraceRecorder(os.path.join(base_dir, trace))
+        except OSError as e:
+            print(f"无法记录触发: {e}")
+    with startup_profiler.phase("快捷键"):
+        setup_global_hotkey()
+    engine_thread = threading.Thread(target=load_engine, args=(on_ready,), name="engine-loader", daemon=True)
+    engine_thread.start()
 
-# 全局变量
-listener = None
-key_recording = False
-recorded_keys = []
+def shutdown_engine():
+    """停止所有后台线程并释放音频资源"""
+    shutdown_event.set()
+    stop_global_hotkey()
+    if trace_recorder is not None:
+        trace_recorder.close()
+    if engine_thread is not None:
+        # 加载线程看到shutdown_event后会尽快退出；解码很慢时不无限等待，它是守护线程
+        engine_thread.join(timeout=ENGINE_JOIN_TIMEOUT)
+    trigger_queue.stop()
+    config_saver.flush()
+    if not engine_ready.is_set():
+        return
+    config_watcher.stop()
+    if governor is not None:
+        governor.stop()
+    if stats_exporter is not None:
+        stats_exporter.stop()
+    voice_manager.stop_reaper()
+    voice_manager.stop_all()
+    if software_output:
+        software_output.stop()
+    decode_pool.shutdown()
+    variant_cache.shutdown()
+    sound_cache.clear()
+    variant_cache.clear()
+    audio_library.stop_watching()
 
 # ========== 音频播放函数 ==========
-def play_random_audio():
-    audio_files = get_audio_files()
+def drain_ui_queue():
+    """在Tk主线程中执行后台线程排队的界面更新，然后安排下一次轮询"""
+    while True:
+        try:
+            func = ui_queue.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            func()
+        except Exception as e:
+            print(f"界面更新失败: {e}")
+    root.after(UI_POLL_MS, drain_ui_queue)
+
+def set_status(text):
+    """从任意线程更新状态栏（无界面模式下输出到控制台，相同内容不重复输出）
+
+    只是放进界面更新队列，不调用root.after：线程化的Tcl里root.after要等主线程处理，
+    窗口忙或者弹出对话框时会卡住调用它的触发消费线程。
+    """
+    global last_status
+    if root is None:
+        if text != last_status:
+            last_status = text
+            print(f"[状态] {text}")
+        return
+    ui_queue.put(lambda: status_label.config(text=text))
+
+def set_message(text):
+    """从任意线程更新消息栏（无界面模式下输出到控制台）"""
+    if root is None:
+        print(f"[消息] {text}")
+        return
+    ui_queue.put(lambda: message_label.config(text=text))
+
+def set_hotkey_label(text):
+    """从任意线程更新快捷键提示"""
+    if root is not None:
+        ui_queue.put(lambda: hotkey_label.config(text=text))
+
+def trigger_play(pool=None):
+    """播放按钮：和快捷键一样走触发队列"""
+    trigger_queue.submit(pool)
+
+def play_random_audio(trigger_time=None, pool=None):
+    if trigger_time is None:
+        trigger_time = time.perf_counter()
     
-    if not audio_files:
-        message_label.config(text=f"未找到音频文件！\n请将MP3/WAV/OGG/FLAC文件放在:\n{base_dir}")
+    dispatch_time = time.perf_counter()
+    selected_file, decoded = decode_pool.take(pool)
+    
+    if selected_file is None:
+        trigger_stats.count("missing")
+        set_message(f"未找到音频文件！\n请将MP3/WAV/OGG/FLAC文件放在:\n{base_dir}")
         return
     
-    selected_file = random.choice(audio_files)
-    file_name = os.path.basename(selected_file)
+    file_name = clip_display_name(selected_file)
     
     try:
-        sound = mixer.Sound(selected_file)
-        channel = mixer.find_channel()
-        if channel:
-            channel.play(sound)
-            active_sounds.append(sound)
-            
-            status_label.config(text=f"正在播放: {file_name}\n活动音频: {len(active_sounds)}")
-            
-            def remove_sound():
-                if sound in active_sounds:
-                    active_sounds.remove(sound)
-                    if active_sounds:
-                        status_label.config(text=f"活动音频: {len(active_sounds)}")
-                    else:
-                        status_label.config(text=f"就绪 - 点击按钮或按{current_hotkey_display}播放")
+        # 解码线程出问题时不让触发队列一直等下去
+        sound = decoded.result(timeout=DECODE_TIMEOUT_SECONDS)
+        if not isinstance(sound, StreamSource):
+            # 随机选一个预先生成的变调版本，按键时不做重采样
+            sound = variant_cache.pick(selected_file, sound)
+        if normalize_enabled:
+            apply_normalization(selected_file, sound)
+        ready_time = time.perf_counter()
+        if isinstance(sound, StreamSource):
+            started = play_stream(selected_file, sound)
+        else:
+            voice = voice_manager.play(selected_file, sound)
+            started = voice.started if voice else None
+        if started is not None:
+            latency_ms = latency_monitor.record(trigger_time, started)
+            trigger_stats.record(trigger_time, dispatch_time, ready_time, started)
             
-            root.after(int(sound.get_length() * 1000) + 100, remove_sound)
+            set_status(f"正在播放: {file_name}\n活动音频: {voice_manager.active_count()}  延迟: {latency_ms:.1f} ms")
         else:
-            status_label.config(text="所有通道都在使用中，请等待...")
+            trigger_stats.count("no_voice")
+            set_status("所有通道都在使用中，请等待...")
             
     except Exception as e:
-        status_label.config(text=f"播放失败: {file_name}\n错误: {str(e)}")
+        trigger_stats.count("failed")
+        set_status(f"播放失败: {file_name}\n错误: {str(e)}")
+
+def play_stream(clip_id, stream):
+    """流式播放一个长片段，返回开始播放的时间，无法播放时返回None"""
+    if stream.reader is not None:
+        chunks = stream.chunks()
+        first = next(chunks, None)
+        if first is None:
+            return None
+        voice = voice_manager.play(clip_id, first, stream=chunks)
+        return voice.started if voice else None
+    
+    # mixer.music只有一路，正在使用时丢弃这次触发，不在触发线程上整体解码长文件
+    voice = voice_manager.play_music(clip_id, stream)
+    return voice.started if voice else None
+
+def update_voice_status(active_count):
+    """声部数量变化后更新状态栏"""
+    if active_count:
+        text = f"活动音频: {active_count}"
+    else:
+        text = f"就绪 - 点击按钮或按{current_hotkey_display}播放"
+    if governor is not None and governor.level:
+        text += f"\n资源调节: {GOVERNOR_LEVELS[governor.level]}"
+    set_status(text)
+
+def on_voices_changed(active_count, overdue):
+    """回收线程回调：更新状态栏，并把播放超时（欠载）报告给延迟监视器"""
+    for _ in overdue:
+        fallback = latency_monitor.report_overrun()
+        if fallback:
+            print(f"检测到音频欠载，回退到延迟档位 {fallback}")
+            trigger_queue.call(switch_latency_profile, fallback)
+            break
+    update_voice_status(active_count)
+
+def decoded_total_bytes():
+    """缓存、变调版本和正在播放的Sound一共占用的解码内存，同一个Sound只算一次"""
+    with sound_cache.lock:
+        sounds = {id(entry[0]): entry[0] for entry in sound_cache.entries.values()}
+    with variant_cache.lock:
+        for variants, _ in variant_cache.entries.values():
+            sounds.update((id(sound), sound) for sound in variants)
+    with voice_manager.lock:
+        sounds.update((id(voice.sound), voice.sound) for voice in voice_manager.voices.values()
+                      if not isinstance(voice.sound, StreamSource))
+    return sum(sound_nbytes(sound) for sound in sounds.values())
+
+def governor_decoded_limit():
+    """解码内存的紧张阈值：缓存塞满是正常状态，所以在两个缓存的预算之上再留出余量"""
+    headroom_mb = config.get("governor_decoded_headroom_mb", DEFAULT_GOVERNOR_DECODED_HEADROOM_MB)
+    if not headroom_mb:
+        return 0
+    budget_mb = (config.get("sound_cache_mb", DEFAULT_SOUND_CACHE_MB)
+                 + config.get("variant_cache_mb", DEFAULT_VARIANT_CACHE_MB))
+    return int((budget_mb + headroom_mb) * 1024 * 1024)
+
+def measure_resources():
+    """资源调节检查的指标"""
+    return {
+        "rss_bytes": process_rss_bytes(),
+        "decoded_bytes": decoded_total_bytes(),
+        "channel_load": round(voice_manager.active_count() / max(1, voice_manager.max_channels), 3),
+    }
+
+def prefer_short_clips(weight_func, max_seconds):
+    """在原有权重上压低长片段：超过max_seconds的片段权重按(max_seconds/时长)²缩小"""
+    def weight(clip_id):
+        value = weight_func(clip_id) if weight_func else 1.0
+        length = audio_library.clip_length(clip_id)
+        if length is not None and length > max_seconds:
+            value *= (max_seconds / length) ** 2
+        return value
+    
+    return weight
+
+def apply_governor_level(level):
+    """执行资源调节的某一级（每级都按配置重新设置，撤销时同样调用）"""
+    global short_clips_weight, saved_weight_func
+    scale = GOVERNOR_CACHE_SCALE if level >= 1 else 1.0
+    sound_cache.set_budget(int(config.get("sound_cache_mb", DEFAULT_SOUND_CACHE_MB) * 1024 * 1024 * scale))
+    variant_cache.set_budget(int(config.get("variant_cache_mb", DEFAULT_VARIANT_CACHE_MB) * 1024 * 1024 * scale))
+    
+    if level >= 2 and not short_clips_weight:
+        saved_weight_func = audio_library.weight_func
+        audio_library.set_weight_func(prefer_short_clips(
+            saved_weight_func, config.get("governor_short_clip_seconds", DEFAULT_GOVERNOR_SHORT_CLIP_SECONDS)))
+        short_clips_weight = True
+    elif level < 2 and short_clips_weight:
+        audio_library.set_weight_func(saved_weight_func)
+        short_clips_weight = False
+    
+    with voice_manager.lock:
+        voice_manager.voice_limit = config.get("governor_voice_limit", DEFAULT_GOVERNOR_VOICE_LIMIT) if level >= 3 else None
+    
+    event = governor.events[-1] if governor and governor.events else None
+    reasons = {"rss_bytes": "进程内存", "decoded_bytes": "解码内存", "channel_load": "通道负载"}
+    if level and event and event["reasons"]:
+        text = f"资源紧张（{'、'.join(reasons[r] for r in event['reasons'])}），已{GOVERNOR_LEVELS[level]}"
+    elif level:
+        text = f"资源有所恢复，保持{GOVERNOR_LEVELS[level]}"
+    else:
+        text = "资源恢复正常，已撤销所有调节"
+    set_message(text)
+    update_voice_status(voice_manager.active_count())
+
+def apply_normalization(clip_id, sound):
+    """播放前按响度分析结果设置音量；还没分析过的文件交给后台分析"""
+    info = audio_library.clip_info(clip_id)
+    if info is not None and "loudness_db" in info:
+        sound.set_volume(normalization_gain(info, normalize_target_db))
+        return
+    
+    path = clip_source(clip_id)
+    if path not in pending_analysis:
+        pending_analysis.add(path)
+        
+        def analyze():
+            try:
+                with mixer_gate.use():
+                    analyze_file(audio_library, path, source_loader, trim_options)
+                sound_cache.discard_source(path)
+                variant_cache.discard_source(path)
+                decode_pool.discard_source(path)
+                audio_library.refresh()
+                decode_pool.fill()
+            finally:
+                pending_analysis.discard(path)
+        
+        decode_pool.executor.submit(analyze)
+
+def process_library():
+    """在后台线程中处理音频索引里的文件：生成PCM缓存、分析响度、裁剪静音和切分"""
+    def report(text):
+        set_status(text)
+    
+    def worker():
+        # 多次触发时串行执行，后一次只需处理变化的文件
+        with library_job_lock:
+            files = list(audio_library.sources)
+            if pcm_cache:
+                # 采样库里已有的文件不需要再生成PCM缓存
+                pcm_cache.build([p for p in files if not (sample_bank and sample_bank.pcm(p) is not None)], lambda done, total: report(f"正在生成PCM缓存: {done}/{total}"))
+            if normalize_enabled or trim_options.enabled or audio_library.dedupe:
+                # 查重要比较所有文件夹里的文件，不只是参与默认选择的
+                if analyze_library(audio_library.all_sources() if audio_library.dedupe else files, report):
+                    decode_pool.fill()
+        update_voice_status(voice_manager.active_count())
+    
+    threading.Thread(target=worker, daemon=True).start()
+
+def analyze_library(files, report):
+    """分析还没有结果或结果过期的文件，然后重建可选列表；返回是否分析了文件"""
+    todo = [p for p in files if needs_analysis(audio_library.get_metadata(p), normalize_enabled,
+                                               trim_options, bool(audio_library.dedupe))]
+    for i, path in enumerate(todo):
+        report(f"正在分析音频: {i + 1}/{len(todo)}")
+        try:
+            with mixer_gate.use():
+                analyze_file(audio_library, path, source_loader, trim_options)
+            sound_cache.discard_source(path)
+            variant_cache.discard_source(path)
+            decode_pool.discard_source(path)
+        except Exception as e:
+            print(f"音频分析失败: {path}: {e}")
+    if todo:
+        audio_library.save_metadata()
+        audio_library.refresh()
+    return bool(todo)
+
+def on_library_changed_jobs(library):
+    process_library()
+
+def switch_latency_profile(profile):
+    """切换延迟档位：重新初始化mixer，并丢弃按旧格式解码的声音（在触发队列线程中执行）"""
+    global latency_profile
+    if profile == latency_profile:
+        return
+    
+    print(f"延迟档位从 {latency_profile} 切换到 {profile}")
+    # 等解码、变调、分析和回收线程离开mixer，重新初始化期间不让它们进入
+    with mixer_gate.exclusive():
+        if software_output:
+            # 输出线程不能在mixer关闭期间访问它
+            software_output.stop()
+            soft_mixer.stop()
+        mixer.quit()
+        sound_cache.clear()
+        variant_cache.clear()
+        latency_profile = init_mixer(profile)
+        voice_manager.reset(voice_manager.num_channels)
+        if software_output:
+            soft_mixer.frequency = mixer.get_init()[0]
+            software_output.start()
+    latency_monitor.switch(latency_profile)
+    decode_pool.reset()
+    if pcm_cache:
+        # 采样率变了，需要按新格式重新生成
+        process_library()
+    set_status(f"音频欠载，已切换到延迟档位: {latency_profile}")
+
+# 配置文件被外部修改后可以立即生效的项，其余的需要重启
+LIVE_CONFIG_KEYS = {
+    "hotkey", "hotkey_display", "bindings", "tags",
+    "sound_cache_mb", "prefetch_depth", "latency_profile",
+    "trigger_debounce_ms", "max_triggers_per_second", "trigger_burst",
+    "normalize_target_db", "steal_policy", "max_instances_per_file", "limiter", "max_channels",
+    "pitch_variation_semitones", "pitch_variants", "variant_cache_mb",
+    "governor_rss_mb", "governor_decoded_headroom_mb", "governor_channel_load", "governor_release_ratio",
+    "governor_calm_checks", "governor_short_clip_seconds", "governor_voice_limit",
+}
+
+def apply_config(new_config):
+    """应用配置文件的修改：快捷键只替换绑定表，缓存和限速直接调整参数，
+    只有延迟档位变化时才（在触发队列线程中）重新初始化mixer"""
+    global current_hotkey, current_hotkey_display, normalize_target_db
+    changed = {key for key in set(config) | set(new_config)
+               if key != "config_version" and config.get(key) != new_config.get(key)}
+    if not changed:
+        return
+    config.clear()
+    config.update(new_config)
+    print(f"配置文件已修改: {', '.join(sorted(changed))}")
+    
+    if changed & {"hotkey", "hotkey_display", "bindings", "tags"}:
+        current_hotkey = config.get("hotkey", DEFAULT_HOTKEY)
+        current_hotkey_display = config.get("hotkey_display", DEFAULT_HOTKEY)
+        setup_global_hotkey()
+    if "sound_cache_mb" in changed:
+        sound_cache.set_budget(int(config.get("sound_cache_mb", DEFAULT_SOUND_CACHE_MB) * 1024 * 1024))
+    if "prefetch_depth" in changed:
+        decode_pool.depth = config.get("prefetch_depth", DEFAULT_PREFETCH_DEPTH)
+        decode_pool.fill()
+    if changed & {"trigger_debounce_ms", "max_triggers_per_second", "trigger_burst"}:
+        trigger_queue.configure(config.get("trigger_debounce_ms", DEFAULT_TRIGGER_DEBOUNCE_MS),
+                                config.get("max_triggers_per_second", DEFAULT_MAX_TRIGGERS_PER_SECOND),
+                                config.get("trigger_burst", DEFAULT_TRIGGER_BURST))
+    if changed & {"pitch_variation_semitones", "pitch_variants", "variant_cache_mb"}:
+        variant_cache.configure(int(config.get("variant_cache_mb", DEFAULT_VARIANT_CACHE_MB) * 1024 * 1024),
+                                config.get("pitch_variation_semitones", DEFAULT_PITCH_VARIATION_SEMITONES),
+                                config.get("pitch_variants", DEFAULT_PITCH_VARIANTS))
+    if "normalize_target_db" in changed:
+        normalize_target_db = config.get("normalize_target_db", DEFAULT_NORMALIZE_TARGET_DB)
+    if changed & {"steal_policy", "max_instances_per_file", "limiter", "max_channels"}:
+        with voice_manager.lock:
+            policy = config.get("steal_policy", DEFAULT_STEAL_POLICY)
+            voice_manager.policy = policy if policy in STEAL_POLICIES else DEFAULT_STEAL_POLICY
+            voice_manager.max_per_file = config.get("max_instances_per_file", DEFAULT_MAX_INSTANCES_PER_FILE)
+            voice_manager.limiter = config.get("limiter", DEFAULT_LIMITER) == "voices"
+            voice_manager.max_channels = max(voice_manager.num_channels,
+                                             config.get("max_channels", DEFAULT_MAX_CHANNELS))
+    if governor is not None and (changed & {"sound_cache_mb", "variant_cache_mb"}
+                                 or any(key.startswith("governor_") for key in changed)):
+        governor.configure(int(config.get("governor_rss_mb", DEFAULT_GOVERNOR_RSS_MB) * 1024 * 1024),
+                           governor_decoded_limit(),
+                           config.get("governor_channel_load", DEFAULT_GOVERNOR_CHANNEL_LOAD),
+                           config.get("governor_release_ratio", DEFAULT_GOVERNOR_RELEASE_RATIO),
+                           config.get("governor_calm_checks", DEFAULT_GOVERNOR_CALM_CHECKS))
+    if "latency_profile" in changed:
+        profile = config.get("latency_profile", DEFAULT_LATENCY_PROFILE)
+        if profile in LATENCY_PROFILES:
+            trigger_queue.call(switch_latency_profile, profile)
+        else:
+            print(f"未知的延迟档位: {profile}")
+    
+    restart = sorted(changed - LIVE_CONFIG_KEYS)
+    if restart:
+        set_message(f"以下配置需要重启才能生效: {', '.join(restart)}")
 
 # ========== 快捷键处理 ==========
-def on_activate():
-    root.after(0, play_random_audio)
+class HotkeyDispatcher:
+    """单个常驻的全局键盘监听器：按当前按下的按键集合查表，分发到对应的快捷键绑定"""
+
+    def __init__(self, on_trigger):
+        self.on_trigger = on_trigger  # 回调(绑定)，在监听线程中调用
+        self.table = {}  # frozenset(按键) -> 绑定
+        self.keys = frozenset()  # 出现在任一绑定中的按键
+        self.pressed = set()
+        self.record_hook = None  # 设置界面录制快捷键时使用：(按下回调, 释放回调)
+        self.listener = None
+
+    @staticmethod
+    def parse(hotkey_str):
+        """解析快捷键字符串，格式错误时抛出ValueError"""
+        return frozenset(import_keyboard().HotKey.parse(hotkey_str))
+
+    def set_bindings(self, bindings):
+        """整体替换绑定表，监听线程不需要重启"""
+        table = {self.parse(binding["hotkey"]): binding for binding in bindings}
+        self.keys = frozenset().union(*table)
+        self.table = table
+
+    def start(self):
+        """启动监听线程（只启动一次）"""
+        if self.listener is None:
+            self.listener = import_keyboard().Listener(on_press=self._on_press, on_release=self._on_release)
+            self.listener.start()
+
+    def stop(self):
+        """停止监听线程"""
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+        self.pressed.clear()
+
+    def _on_press(self, key):
+        hook = self.record_hook
+        if hook:
+            hook[0](key)
+            return
+        
+        canonical = self.listener.canonical(key)
+        if canonical not in self.keys or canonical in self.pressed:
+            # 与任何绑定无关的按键不记录；按住不放时的自动重复也忽略
+            return
+        self.pressed.add(canonical)
+        if not any(self.pressed <= keys for keys in self.table):
+            # 漏掉了释放事件时残留的按键会让所有绑定失效：只保留与当前按键同属一个绑定的按键
+            best = max((keys for keys in self.table if canonical in keys), key=lambda keys: len(keys & self.pressed))
+            self.pressed &= best
+        binding = self.table.get(frozenset(self.pressed))
+        if binding is not None:
+            self.on_trigger(binding)
+
+    def _on_release(self, key):
+        self.pressed.discard(self.listener.canonical(key))
+        hook = self.record_hook
+        if hook:
+            hook[1](key)
+
+def get_bindings(hotkey_str=None):
+    """当前所有快捷键绑定：主快捷键播放默认声音池，其余来自配置中的bindings"""
+    primary = {"hotkey": hotkey_str or current_hotkey, "display": current_hotkey_display, "pool": None}
+    bindings = [primary]
+    for binding in config.get("bindings", []):
+        if not binding.get("hotkey"):
+            continue
+        try:
+            HotkeyDispatcher.parse(binding["hotkey"])
+        except ValueError as e:
+            print(f"忽略无效的快捷键绑定 {binding['hotkey']}: {e}")
+            continue
+        bindings.append({"hotkey": binding["hotkey"],
+                         "display": binding.get("display", binding["hotkey"]),
+                         "pool": binding.get("pool") or None})
+    return bindings
+
+def apply_pools(bindings):
+    """按绑定用到的声音池更新音频索引（音频索引还没创建时跳过，由init_audio补上）"""
+    if audio_library is None:
+        return
+    tags = config.get("tags", {})
+    names = {binding["pool"] for binding in bindings if binding["pool"]}
+    audio_library.set_pools({name: make_pool_filter(base_dir, name, tags) for name in names})
+
+def ensure_pool(name):
+    """快捷键绑定之外用到的声音池（控制接口、离线渲染）按需注册，返回池中的片段数"""
+    with audio_library.lock:
+        known = name in audio_library.pool_filters
+        filters = dict(audio_library.pool_filters)
+    if not known:
+        filters[name] = make_pool_filter(base_dir, name, config.get("tags", {}))
+        audio_library.set_pools(filters)
+        decode_pool.fill(name)
+    entry = audio_library.pools.get(name)
+    return len(entry[0]) if entry else 0
+
+def hotkey_label_text():
+    extra = len(hotkey_dispatcher.table) - 1
+    if extra > 0:
+        return f"全局快捷键: {current_hotkey_display}  (另有{extra}个绑定)"
+    return f"全局快捷键: {current_hotkey_display}"
+
+def on_activate(binding):
+    trigger_time = time.perf_counter()
+    if trace_recorder is not None:
+        # 记录原始按键，包括随后被防抖或限速过滤的
+        trace_recorder.record(binding["pool"], trigger_time)
+    trigger_queue.submit(binding["pool"], trigger_time)
+
+hotkey_dispatcher = HotkeyDispatcher(on_activate)
 
 def stop_global_hotkey():
-    """停止当前的全局快捷键监听"""
-    global listener
-    if listener:
-        listener.stop()
-        listener = None
+    """停止全局快捷键监听"""
+    hotkey_dispatcher.stop()
 
 def setup_global_hotkey(hotkey_str=None):
-    """设置全局快捷键"""
-    global listener, current_hotkey, current_hotkey_display
+    """设置全局快捷键：只替换绑定表，监听线程保持运行"""
+    global current_hotkey, current_hotkey_display
     
     if hotkey_str is None:
         hotkey_str = current_hotkey
     
-    # 停止现有的监听器
-    stop_global_hotkey()
-    
     try:
         # 验证热键格式
-        hotkey = keyboard.HotKey(
-            keyboard.HotKey.parse(hotkey_str),
-            on_activate
-        )
-        
-        listener = keyboard.Listener(
-            on_press=lambda key: hotkey.press(listener.canonical(key)),
-            on_release=lambda key: hotkey.release(listener.canonical(key))
-        )
-        
-        listener.start()
+        HotkeyDispatcher.parse(hotkey_str)
+        bindings = get_bindings(hotkey_str)
+        hotkey_dispatcher.set_bindings(bindings)
+        apply_pools(bindings)
+        hotkey_dispatcher.start()
         
         # 更新显示
-        hotkey_label.config(text=f"全局快捷键: {current_hotkey_display}")
-        status_label.config(text=f"就绪 - 点击按钮或按{current_hotkey_display}播放")
+        set_hotkey_label(hotkey_label_text())
+        if engine_ready.is_set():
+            set_status(f"就绪 - 点击按钮或按{current_hotkey_display}播放")
         
         print(f"快捷键设置成功: {hotkey_str}")
-        return listener
+        return hotkey_dispatcher
     except Exception as e:
         print(f"快捷键设置失败: {e}")
         # 如果设置失败，使用默认热键
         try:
-            default_hotkey = keyboard.HotKey(
-                keyboard.HotKey.parse(DEFAULT_HOTKEY),
-                on_activate
-            )
-            
-            listener = keyboard.Listener(
-                on_press=lambda key: default_hotkey.press(listener.canonical(key)),
-                on_release=lambda key: default_hotkey.release(listener.canonical(key))
-            )
-            
-            listener.start()
-            
             # 恢复默认设置
             current_hotkey = DEFAULT_HOTKEY
             current_hotkey_display = DEFAULT_HOTKEY
+            bindings = get_bindings(DEFAULT_HOTKEY)
+            hotkey_dispatcher.set_bindings(bindings)
+            apply_pools(bindings)
+            hotkey_dispatcher.start()
+            
             config["hotkey"] = DEFAULT_HOTKEY
             config["hotkey_display"] = DEFAULT_HOTKEY
             save_config(config)
             
-            hotkey_label.config(text=f"全局快捷键: {DEFAULT_HOTKEY}")
-            status_label.config(text="就绪 - 点击按钮或按{DEFAULT_HOTKEY}播放")
+            set_hotkey_label(hotkey_label_text())
+            if engine_ready.is_set():
+                set_status(f"就绪 - 点击按钮或按{DEFAULT_HOTKEY}播放")
             
             print(f"已恢复默认快捷键: {DEFAULT_HOTKEY}")
-            return listener
+            return hotkey_dispatcher
         except Exception as e2:
             print(f"默认快捷键也设置失败: {e2}")
-            messagebox.showerror("错误", f"快捷键设置失败！\n错误: {e}\n请使用默认快捷键{DEFAULT_HOTKEY}")
+            if root is not None:
+                messagebox.showerror("错误", f"快捷键设置失败！\n错误: {e}\n请使用默认快捷键{DEFAULT_HOTKEY}")
+            return None
+
+def reload_bindings():
+    """从配置文件重新读取快捷键绑定和标签，监听线程不重启"""
+    global current_hotkey, current_hotkey_display
+    new_config = load_config()
+    for key in ("hotkey", "hotkey_display", "bindings", "tags"):
+        if key in new_config:
+            config[key] = new_config[key]
+    current_hotkey = config.get("hotkey", DEFAULT_HOTKEY)
+    current_hotkey_display = config.get("hotkey_display", DEFAULT_HOTKEY)
+    setup_global_hotkey()
+
+# ========== 控制接口 ==========
+def collect_stats():
+    """汇总运行统计（音频还在加载时只有触发计数）"""
+    stats = {"ready": engine_ready.is_set(), "triggers": trigger_queue.stats()}
+    if not stats["ready"]:
+        return stats
+    
+    cache = sound_cache.stats()
+    variants = variant_cache.stats()
+    voices = voice_manager.stats()
+    prefetch_total = decode_pool.ready_hits + decode_pool.waits
+    stats.update({
+        "library": {"sources": len(audio_library.sources), "clips": len(audio_library.files),
+                    "duplicates": len(audio_library.duplicates),
+                    "pools": {name: len(entry[0]) for name, entry in audio_library.pools.items()}},
+        "cache": cache,
+        "variants": variants,
+        "prefetch": {"ready": decode_pool.ready_hits, "waits": decode_pool.waits,
+                     "hit_rate": round(decode_pool.ready_hits / prefetch_total, 3) if prefetch_total else None},
+        "voices": voices,
+        "timing": trigger_stats.summary(),
+        "latency": latency_monitor.summary(),
+        "memory": {"decoded_bytes": cache["bytes"] + variants["bytes"], "playing_bytes": voices["playing_bytes"],
+                   "rss_bytes": process_rss_bytes()},
+    })
+    if pcm_cache:
+        stats["pcm_cache"] = {"hits": pcm_cache.hits}
+    if sample_bank:
+        stats["sample_bank"] = {"entries": len(sample_bank.entries), "hits": sample_bank.hits}
+    if governor is not None:
+        stats["governor"] = governor.stats()
+    return stats
+
+def format_stats(stats):
+    """把运行统计整理成统计窗口中显示的文本"""
+    def mb(value):
+        return "未知" if value is None else f"{value / 1024 / 1024:.1f} MB"
+    
+    def rate(value):
+        return "-" if value is None else f"{value * 100:.0f}%"
+    
+    triggers = stats["triggers"]
+    lines = [f"触发: 接受 {triggers['accepted']}  防抖过滤 {triggers['suppressed_debounce']}  "
+             f"限速过滤 {triggers['suppressed_rate']}"]
+    if not stats["ready"]:
+        lines.append("音频正在加载...")
+        return "\n".join(lines)
+    
+    timing = stats["timing"]
+    lines.append(f"播放: {timing['played']}  无可用通道 {timing['no_voice']}  "
+                 f"失败 {timing['failed']}  无文件 {timing['missing']}")
+    lines.append("")
+    lines.append("阶段耗时 (p50 / p95 / max 毫秒):")
+    names = {"queue": "按键->分发", "decode": "分发->解码", "play": "解码->播放", "total": "按键->播放"}
+    for stage in TIMING_STAGES:
+        item = timing[stage]
+        if item["count"]:
+            lines.append(f"  {names[stage]}: {item['p50_ms']:.2f} / {item['p95_ms']:.2f} / {item['max_ms']:.2f}")
+        else:
+            lines.append(f"  {names[stage]}: -")
+    
+    cache, prefetch, voices, memory = stats["cache"], stats["prefetch"], stats["voices"], stats["memory"]
+    lines.append("")
+    lines.append(f"解码缓存: {cache['entries']}个  命中率 {rate(cache['hit_rate'])}  淘汰 {cache['evictions']}")
+    lines.append(f"预取: 命中率 {rate(prefetch['hit_rate'])}  等待 {prefetch['waits']}")
+    variants = stats["variants"]
+    if variants["enabled"]:
+        lines.append(f"变调版本: {variants['clips']}个片段  {mb(variants['bytes'])}  "
+                     f"命中 {variants['hits']}  未生成 {variants['misses']}")
+    lines.append(f"声部: 活动 {voices['active']}/{voices['channels']}  抢占 {voices['steals']}  "
+                 f"扩容 {voices['grows']}  丢弃 {voices['drops']}")
+    lines.append(f"内存: 缓存 {mb(memory['decoded_bytes'])} / {mb(cache['budget_bytes'])}  "
+                 f"播放中 {mb(memory['playing_bytes'])}  进程 {mb(memory['rss_bytes'])}")
+    latency = stats["latency"]
+    lines.append(f"延迟档位: {latency['profile']}  输出缓冲 {latency['output_ms']:.1f} ms  欠载 {latency['underruns']}")
+    governor_stats = stats.get("governor")
+    if governor_stats:
+        last = governor_stats["last"]
+        lines.append(f"资源调节: {governor_stats['action']}  调整 {governor_stats['adaptations']}次  "
+                     f"解码内存 {mb(last.get('decoded_bytes'))}  通道负载 {rate(last.get('channel_load'))}")
+    return "\n".join(lines)
+
+def handle_control_command(request):
+    """处理一条控制命令，返回响应字典"""
+    cmd = request.get("cmd")
+    if cmd == "play":
+        pool = request.get("pool") or None
+        if pool is not None and not ensure_pool(pool):
+            return {"ok": False, "error": f"声音池中没有音频文件: {pool}"}
+        accepted = trigger_queue.submit(pool)
+        return {"ok": True, "accepted": accepted}
+    if cmd == "stop_all":
+        trigger_queue.call(voice_manager.stop_all)
+        return {"ok": True}
+    if cmd == "reload":
+        audio_library.scan()
+        reload_bindings()
+        return {"ok": True, "clips": len(audio_library.files)}
+    if cmd == "stats":
+        return {"ok": True, "stats": collect_stats()}
+    if cmd == "duplicates":
+        return {"ok": True, "duplicates": duplicate_report(audio_library)}
+    return {"ok": False, "error": f"未知命令: {cmd}"}
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """JSON Lines控制协议：每行一个请求，每个请求回复一行"""
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                response = handle_control_command(json.loads(line.decode('utf-8')))
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode('utf-8'))
+
+class ControlTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def start_control_server(port=None, socket_path=None):
+    """启动控制接口：优先使用Unix域套接字，否则监听127.0.0.1上的TCP端口，返回服务器对象"""
+    if socket_path:
+        if not hasattr(socketserver, "UnixStreamServer"):
+            print("当前系统不支持Unix域套接字")
             return None
+        
+        class ControlUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+        
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ControlUnixServer(socket_path, ControlHandler)
+        address = socket_path
+    elif port:
+        server = ControlTCPServer(("127.0.0.1", port), ControlHandler)
+        address = f"127.0.0.1:{port}"
+    else:
+        return None
+    
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"控制接口已启动: {address}")
+    return server
 
 # ========== 设置界面 ==========
 def open_settings():
@@ -239,7 +3901,6 @@ def open_settings():
     # 状态变量
     recording = False
     key_combination = []
-    key_listener = None
     
     def on_key_press(key):
         """按键按下事件"""
@@ -300,7 +3961,7 @@ def open_settings():
     
     def start_recording():
         """开始录制快捷键"""
-        nonlocal recording, key_combination, key_listener
+        nonlocal recording, key_combination
         
         recording = True
         key_combination = []
@@ -309,15 +3970,14 @@ def open_settings():
         stop_button.config(state="normal")
         apply_button.config(state="disabled")
         
-        # 启动键盘监听
-        key_listener = keyboard.Listener(
-            on_press=on_key_press,
-            on_release=on_key_release)
-        key_listener.start()
+        # 借用全局监听器录制，录制期间不触发播放；回调在监听线程中调用，
+        # 通过界面更新队列转到Tk主线程处理，按键记录和界面更新都只在主线程中进行
+        hotkey_dispatcher.record_hook = (lambda key: ui_queue.put(lambda: on_key_press(key)),
+                                         lambda key: ui_queue.put(lambda: on_key_release(key)))
     
     def stop_recording():
         """停止录制快捷键"""
-        nonlocal recording, key_listener
+        nonlocal recording
         
         recording = False
         key_display.config(fg="black")
@@ -325,9 +3985,8 @@ def open_settings():
         stop_button.config(state="disabled")
         apply_button.config(state="normal")
         
-        # 停止键盘监听
-        if key_listener:
-            key_listener.stop()
+        # 停止录制
+        hotkey_dispatcher.record_hook = None
     
     def apply_hotkey():
         """应用新的快捷键"""
@@ -467,60 +4126,304 @@ def open_settings():
     
     settings_window.protocol("WM_DELETE_WINDOW", on_settings_close)
 
+# ========== 统计窗口 ==========
+STATS_REFRESH_MS = 1000
+stats_window = None
+
+def open_stats_window():
+    """打开运行统计窗口（只开一个），每秒刷新"""
+    global stats_window
+    if stats_window is not None and stats_window.winfo_exists():
+        stats_window.lift()
+        return
+    
+    stats_window = tk.Toplevel(root)
+    stats_window.title("运行统计")
+    stats_window.geometry("520x340")
+    stats_window.transient(root)
+    
+    text_label = tk.Label(stats_window, font=("Consolas", 10), justify=tk.LEFT, anchor="nw")
+    text_label.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+    
+    def export_now():
+        path = config.get("stats_log") or "stats.jsonl"
+        try:
+            StatsExporter(os.path.join(base_dir, path), 0, collect_stats).write()
+            set_message(f"运行统计已追加到 {path}")
+        except Exception as e:
+            messagebox.showerror("错误", f"导出失败: {e}", parent=stats_window)
+    
+    tk.Button(stats_window, text="导出到日志", command=export_now, width=15).pack(pady=(0, 10))
+    
+    def refresh():
+        if not stats_window.winfo_exists():
+            return
+        try:
+            text_label.config(text=format_stats(collect_stats()))
+        except Exception as e:
+            text_label.config(text=f"读取统计失败: {e}")
+        stats_window.after(STATS_REFRESH_MS, refresh)
+    
+    refresh()
+
 # ========== GUI界面 ==========
-root = tk.Tk()
-root.title(f"随机音频播放器 - 程序目录: {os.path.basename(base_dir)}")
-root.geometry("600x300")
-
-# 菜单栏
-menubar = tk.Menu(root)
-root.config(menu=menubar)
-
-settings_menu = tk.Menu(menubar, tearoff=0)
-menubar.add_cascade(label="设置", menu=settings_menu)
-settings_menu.add_command(label="快捷键设置", command=open_settings)
-
-# 显示当前目录
-dir_label = tk.Label(root, text=f"程序目录: {base_dir}", 
-                     font=("Arial", 9), fg="blue", wraplength=550)
-dir_label.pack(pady=5)
-
-# 播放按钮
-play_button = tk.Button(root, text="随机播放 (可重叠)", command=play_random_audio, 
-                        font=("Arial", 14), bg="#4CAF50", fg="white",
-                        padx=20, pady=10)
-play_button.pack(pady=10)
-
-# 状态标签
-status_label = tk.Label(root, text=f"就绪 - 点击按钮或按{current_hotkey_display}播放", 
-                        font=("Arial", 10), wraplength=550)
-status_label.pack(pady=10)
-
-# 消息标签
-message_label = tk.Label(root, text="支持格式: MP3, WAV, OGG, FLAC\n音频文件需放在程序同一目录下", 
-                         font=("Arial", 9), fg="gray")
-message_label.pack(pady=5)
-
-# 快捷键提示
-hotkey_label = tk.Label(root, text=f"全局快捷键: {current_hotkey_display}", 
-                        font=("Arial", 9), fg="darkgreen")
-hotkey_label.pack(pady=5)
-
-# 设置按钮
-settings_button = tk.Button(root, text="快捷键设置", 
-                           command=open_settings, width=15)
-settings_button.pack(pady=5)
+def build_gui():
+    """创建主窗口（只有GUI模式才导入tkinter）"""
+    global tk, messagebox
+    global root, status_label, message_label, hotkey_label
+    import tkinter as tk
+    from tkinter import messagebox
+    
+    root = tk.Tk()
+    root.title(f"随机音频播放器 - 程序目录: {os.path.basename(base_dir)}")
+    root.geometry("600x300")
+    
+    # 菜单栏
+    menubar = tk.Menu(root)
+    root.config(menu=menubar)
+    
+    settings_menu = tk.Menu(menubar, tearoff=0)
+    menubar.add_cascade(label="设置", menu=settings_menu)
+    settings_menu.add_command(label="快捷键设置", command=open_settings)
+    settings_menu.add_command(label="重新加载快捷键绑定", command=reload_bindings)
+    settings_menu.add_separator()
+    settings_menu.add_command(label="运行统计", command=open_stats_window)
+    
+    # 显示当前目录
+    dir_label = tk.Label(root, text=f"程序目录: {base_dir}", 
+                         font=("Arial", 9), fg="blue", wraplength=550)
+    dir_label.pack(pady=5)
+    
+    # 播放按钮
+    play_button = tk.Button(root, text="随机播放 (可重叠)", command=trigger_play, 
+                            font=("Arial", 14), bg="#4CAF50", fg="white",
+                            padx=20, pady=10)
+    play_button.pack(pady=10)
+    
+    # 状态标签
+    status_label = tk.Label(root, text="正在加载音频...", 
+                            font=("Arial", 10), wraplength=550)
+    status_label.pack(pady=10)
+    
+    # 消息标签
+    message_label = tk.Label(root, text="支持格式: MP3, WAV, OGG, FLAC\n音频文件需放在程序同一目录下", 
+                             font=("Arial", 9), fg="gray")
+    message_label.pack(pady=5)
+    
+    # 快捷键提示
+    hotkey_label = tk.Label(root, text=hotkey_label_text(), 
+                            font=("Arial", 9), fg="darkgreen")
+    hotkey_label.pack(pady=5)
+    
+    # 设置按钮
+    settings_button = tk.Button(root, text="快捷键设置", 
+                               command=open_settings, width=15)
+    settings_button.pack(pady=5)
+    
+    root.protocol("WM_DELETE_WINDOW", on_closing)
+    root.after(UI_POLL_MS, drain_ui_queue)
 
 # ========== 窗口关闭事件 ==========
 def on_closing():
-    mixer.stop()
-    active_sounds.clear()
-    stop_global_hotkey()
+    shutdown_engine()
     root.destroy()
 
-root.protocol("WM_DELETE_WINDOW", on_closing)
+# ========== 启动 ==========
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="随机音频播放器")
+    parser.add_argument("--headless", action="store_true",
+                        help="无界面模式：只启动混音器、音频索引和全局快捷键，不导入tkinter")
+    parser.add_argument("--port", type=int, default=None,
+                        help="控制接口TCP端口（只监听127.0.0.1），0表示不启用")
+    parser.add_argument("--socket", default=None, help="使用Unix域套接字作为控制接口")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="音频加载完成后输出启动各阶段的耗时")
+    parser.add_argument("--render", metavar="SCRIPT", default=None,
+                        help="离线渲染：按触发脚本（每行\"秒数 [声音池]\"）混音并写入WAV，然后退出")
+    parser.add_argument("--output", default=DEFAULT_RENDER_OUTPUT, help="离线渲染的输出文件（默认写到系统临时目录）")
+    parser.add_argument("--seed", type=int, default=None, help="离线渲染时的随机种子")
+    parser.add_argument("--duplicates", action="store_true",
+                        help="分析音频库，列出重复的音频和合并后节省的内存，然后退出")
+    parser.add_argument("--json", action="store_true", help="--duplicates的结果以JSON输出")
+    return parser.parse_args(argv)
 
-# 设置全局快捷键
-listener = setup_global_hotkey()
+# ========== 重复音频报告 ==========
+def run_duplicates(args):
+    """分析音频库（只分析还没有指纹的文件），输出重复音频报告后退出"""
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    init_config()
+    config.setdefault("dedupe", True)
+    init_audio()
+    try:
+        if not audio_library.dedupe:
+            audio_library.set_dedupe(DEFAULT_DEDUPE_THRESHOLD, DEFAULT_DEDUPE_LENGTH_TOLERANCE)
+        analyze_library(audio_library.all_sources(), print)
+        report = duplicate_report(audio_library)
+    finally:
+        decode_pool.shutdown()
+        variant_cache.shutdown()
+        audio_library.stop_watching()
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(format_duplicate_report(report, base_dir))
+    return report
+
+# ========== 离线渲染 ==========
+def read_trigger_script(path):
+    """读取触发脚本：每行"秒数 [声音池]"，#后面是注释；返回按时间排序的[(秒数, 声音池)]"""
+    triggers = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            # 声音池名称（文件夹名）里可能有空格
+            fields = line.split('#', 1)[0].split(None, 1)
+            if not fields:
+                continue
+            try:
+                at = float(fields[0])
+            except ValueError:
+                raise ValueError(f"{path}第{number}行: 无效的时间 {fields[0]!r}")
+            if at < 0:
+                raise ValueError(f"{path}第{number}行: 时间不能为负数")
+            triggers.append((at, fields[1].strip() if len(fields) > 1 else None))
+    triggers.sort(key=lambda item: item[0])
+    return triggers
+
+def render_sound(clip_id, decoded):
+    """取出渲染用的Sound：流式片段按块返回(首块, 后续块)，只能交给mixer.music的改为整体解码"""
+    sound = decoded.result(timeout=DECODE_TIMEOUT_SECONDS)
+    if isinstance(sound, StreamSource):
+        if sound.reader is not None:
+            chunks = sound.chunks()
+            return next(chunks, None), chunks
+        sound = sound_cache.get(clip_id)
+    else:
+        sound = variant_cache.pick(clip_id, sound)
+    if normalize_enabled:
+        apply_normalization(clip_id, sound)
+    return sound, None
+
+def run_render(args):
+    """按触发脚本离线混音并写入WAV，不打开声卡，也不受实时播放速度限制"""
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    triggers = read_trigger_script(args.render)
+    init_config()
+    init_audio(offline=True)
+    for pool in {pool for _, pool in triggers if pool}:
+        ensure_pool(pool)
+    # 实时播放时在后台做的响度分析和裁剪，这里先做完，渲染结果和实时播放一致
+    if normalize_enabled or trim_options.enabled or audio_library.dedupe:
+        analyze_library(audio_library.all_sources(), print)
+    if args.seed is not None:
+        # 初始化和分析过程中已经做过的选择因分析结果是否已缓存而不同，从种子重新开始
+        random.seed(args.seed)
+        audio_library.clear_recent()
+        decode_pool.reset()
+    output_path = os.path.abspath(args.output)
+    if (output_path.lower().endswith(AUDIO_EXTENSIONS)
+            and output_path.startswith(os.path.join(os.path.abspath(base_dir), ""))):
+        print(f"注意：输出文件在音频目录中，之后会被当作音频播放: {output_path}")
+    
+    frequency, _, channels = mixer.get_init()
+    renderer = SoftwareMixer(frequency, channels)
+    manager = VoiceManager(num_channels=config.get("mixer_channels", DEFAULT_MIXER_CHANNELS),
+                           max_channels=config.get("max_channels", DEFAULT_MAX_CHANNELS),
+                           policy=config.get("steal_policy", DEFAULT_STEAL_POLICY),
+                           max_per_file=config.get("max_instances_per_file", DEFAULT_MAX_INSTANCES_PER_FILE),
+                           backend=renderer)
+    manager.limiter = config.get("limiter", DEFAULT_LIMITER) == "voices"
+    block = config.get("software_block_frames", DEFAULT_SOFTWARE_BLOCK_FRAMES)
+    output = WavOutput(args.output, frequency, channels)
+    
+    def render_until(frame):
+        while renderer.frames < frame:
+            output.write(renderer.mix(min(block, frame - renderer.frames)))
+            manager.reap()
+    
+    start = time.perf_counter()
+    missing = failed = 0
+    try:
+        for at, pool in triggers:
+            render_until(int(at * frequency))
+            clip_id, decoded = decode_pool.take(pool)
+            if clip_id is None:
+                missing += 1
+                continue
+            try:
+                sound, chunks = render_sound(clip_id, decoded)
+            except Exception as e:
+                print(f"渲染失败: {clip_display_name(clip_id)}: {e}")
+                failed += 1
+                continue
+            if sound is not None:
+                manager.play(clip_id, sound, stream=chunks)
+        # 等所有声部播放完
+        while manager.active_count():
+            render_until(renderer.frames + block)
+    finally:
+        output.close()
+        manager.stop_all()
+        decode_pool.shutdown()
+        variant_cache.shutdown()
+        sound_cache.clear()
+        variant_cache.clear()
+        audio_library.stop_watching()
+    
+    elapsed = time.perf_counter() - start
+    rendered = renderer.frames / frequency
+    result = {
+        "output": os.path.abspath(args.output),
+        "triggers": len(triggers),
+        "missing": missing,
+        "failed": failed,
+        "wall_seconds": round(elapsed, 3),
+        "speed": round(rendered / elapsed, 1) if elapsed else None,
+        "mix": renderer.stats(),
+        "voices": manager.stats(),
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return result
+
+def run_gui(args):
+    with startup_profiler.phase("读取配置"):
+        init_config()
+    with startup_profiler.phase("创建窗口"):
+        build_gui()
+    port = args.port if args.port is not None else config.get("control_port", 0)
+    start_engine(on_ready=lambda: start_control_server(port, args.socket))
+    root.after_idle(startup_profiler.mark, "窗口显示")
+    root.mainloop()
+
+def run_headless(args):
+    with startup_profiler.phase("读取配置"):
+        init_config()
+    port = args.port if args.port is not None else (config.get("control_port") or DEFAULT_CONTROL_PORT)
+    servers = []
+    start_engine(on_ready=lambda: servers.append(start_control_server(port, args.socket)))
+    print("无界面模式已启动，按 Ctrl+C 退出")
+    try:
+        while not shutdown_event.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+        shutdown_engine()
+
+def main(argv=None):
+    args = parse_args(argv)
+    startup_profiler.enabled = args.profile_startup
+    if args.render:
+        run_render(args)
+    elif args.duplicates:
+        run_duplicates(args)
+    elif args.headless:
+        run_headless(args)
+    else:
+        run_gui(args)
 
-root.mainloop()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file